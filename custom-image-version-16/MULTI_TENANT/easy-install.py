@@ -2,16 +2,23 @@
 
 import argparse
 import base64
+import gzip
+import hashlib
+import json
 import logging
 import os
 import platform
+import re
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from shutil import move, unpack_archive, which
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 logging.basicConfig(
     filename="easy-install.log",
@@ -43,19 +50,121 @@ def cprint(*args, level: int = 1):
         print(CYLW, message, reset)
 
 
-def clone_frappe_docker_repo() -> None:
+FRAPPE_DOCKER_REPO = "frappe/frappe_docker"
+FRAPPE_DOCKER_REF = "main"
+# Written into the unpacked frappe_docker directory: commit it was unpacked from
+FRAPPE_DOCKER_COMMIT_FILE = ".easy-install-commit"
+
+
+def get_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    cache_dir = os.path.join(cache_home, "easy-install")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def sha256sum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_ref_index(cache_dir: str) -> Dict:
+    try:
+        with open(os.path.join(cache_dir, "refs.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_ref_index(cache_dir: str, index: Dict) -> None:
+    with open(os.path.join(cache_dir, "refs.json"), "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+
+def resolve_frappe_docker_ref(ref: str) -> str:
+    """
+    returns the commit sha of ref (branch, tag or sha) on GitHub,
+    the last commit cached for ref when GitHub can't be reached,
+    or None when neither is available
+    """
+    if re.fullmatch(r"[0-9a-f]{40}", ref):
+        return ref
     try:
-        urllib.request.urlretrieve(
-            "https://github.com/frappe/frappe_docker/archive/refs/heads/main.zip",
-            "frappe_docker.zip",
-        )
-        logging.info("Downloaded frappe_docker zip file from GitHub")
-        unpack_archive("frappe_docker.zip", ".")
-        # Unzipping the frappe_docker.zip creates a folder "frappe_docker-main"
-        move("frappe_docker-main", "frappe_docker")
-        logging.info("Unzipped and Renamed frappe_docker")
-        os.remove("frappe_docker.zip")
-        logging.info("Removed the downloaded zip file")
+        request = urllib.request.Request(
+            f"https://api.github.com/repos/{FRAPPE_DOCKER_REPO}/commits/{ref}",
+            headers={
+                "Accept": "application/vnd.github.sha",
+                "User-Agent": "easy-install",
+            },
+        )
+        with urllib.request.urlopen(request, timeout=15) as response:
+            return response.read().decode("utf-8").strip()
+    except Exception:
+        logging.warning(f"Could not resolve frappe_docker ref {ref}", exc_info=True)
+        commit = read_ref_index(get_cache_dir()).get(ref)
+        if not commit:
+            return None
+        cprint(f"GitHub unreachable, using cached frappe_docker {ref} ({commit[:12]})", level=3)
+        return commit
+
+
+def fetch_frappe_docker_archive(commit: str) -> str:
+    """
+    returns the path of the cached frappe_docker archive of commit,
+    downloading it only when it is missing or fails its checksum
+    """
+    cache_dir = get_cache_dir()
+    archive = os.path.join(cache_dir, f"frappe_docker-{commit}.zip")
+    checksum_file = f"{archive}.sha256"
+    if os.path.exists(archive) and os.path.exists(checksum_file):
+        with open(checksum_file) as f:
+            if f.read().strip() == sha256sum(archive):
+                logging.info(f"Using cached frappe_docker archive {archive}")
+                return archive
+        logging.warning(f"Checksum mismatch, downloading {archive} again")
+
+    partial = f"{archive}.part"
+    urllib.request.urlretrieve(
+        f"https://github.com/{FRAPPE_DOCKER_REPO}/archive/{commit}.zip",
+        partial,
+    )
+    with open(checksum_file, "w") as f:
+        f.write(sha256sum(partial))
+    os.replace(partial, archive)
+    logging.info(f"Downloaded frappe_docker {commit} into {archive}")
+    return archive
+
+
+def get_frappe_docker_commit() -> str:
+    try:
+        with open(os.path.join(get_frappe_docker_path(), FRAPPE_DOCKER_COMMIT_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def clone_frappe_docker_repo(ref: str = FRAPPE_DOCKER_REF) -> None:
+    try:
+        commit = resolve_frappe_docker_ref(ref)
+        if not commit:
+            raise RuntimeError(f"Can't resolve frappe_docker {ref} and nothing is cached for it")
+        archive = fetch_frappe_docker_archive(commit)
+        index = read_ref_index(get_cache_dir())
+        index[ref] = commit
+        write_ref_index(get_cache_dir(), index)
+        with tempfile.TemporaryDirectory(dir=os.getcwd()) as tmp:
+            unpack_archive(archive, tmp, "zip")
+            # The archive holds a single folder "frappe_docker-<commit>"
+            (top,) = os.listdir(tmp)
+            move(os.path.join(tmp, top), get_frappe_docker_path())
+        with open(os.path.join(get_frappe_docker_path(), FRAPPE_DOCKER_COMMIT_FILE), "w") as f:
+            f.write(commit)
+        logging.info(f"Unpacked frappe_docker {ref} ({commit})")
     except Exception as e:
         logging.error("Download and unzip failed", exc_info=True)
         cprint("\nCloning frappe_docker Failed\n\n", "[ERROR]: ", e, level=1)
@@ -145,6 +254,9 @@ def start_prod(
     image: str = None,
     is_https: bool = True,
     http_port: str = None,
+    parallel_pulls: int = 4,
+    recreate_changed: bool = False,
+    rolling: bool = False,
 ):
     if not check_repo_exists():
         clone_frappe_docker_repo()
@@ -154,6 +266,10 @@ def start_prod(
         os.path.expanduser("~"),
         f"{project}-compose.yml",
     )
+    applied_file_name = os.path.join(
+        os.path.expanduser("~"),
+        f"{project}-compose.applied.json",
+    )
 
     env_file_dir = os.path.expanduser("~")
     env_file_name = f"{project}.env"
@@ -265,6 +381,26 @@ def start_prod(
             cprint("\nGenerating Compose File failed\n")
             sys.exit(1)
 
+    # The changed-services check and the rolling upgrade compare local image
+    # ids, and `up` never re-pulls an image that is present: refresh all tags
+    # first, even with --parallel-pulls 0
+    refresh = recreate_changed or rolling
+    if parallel_pulls > 0 or refresh:
+        # A failed pull is left to `up`, which pulls missing images itself
+        pull_compose_images(compose_file_name, max(parallel_pulls, 1), refresh=refresh)
+
+    if rolling:
+        # Containers are replaced by rolling_upgrade()
+        return db_pass, admin_pass
+
+    changed = None
+    if recreate_changed:
+        changed = get_changed_services(
+            get_compose_state(project, compose_file_name), applied_file_name
+        )
+        if changed is None:
+            cprint("\nNo previously applied compose state, recreating all services\n", level=3)
+
     try:
         # Starting with generated compose file
         command = [
@@ -275,15 +411,28 @@ def start_prod(
             "-f",
             compose_file_name,
             "up",
-            "--force-recreate",
-            "--remove-orphans",
-            "-d",
         ]
-        subprocess.run(
-            command,
-            check=True,
-        )
+        if changed is None:
+            subprocess.run(
+                command + ["--force-recreate", "--remove-orphans", "-d"],
+                check=True,
+            )
+        else:
+            # Creates new services and starts stopped ones, leaves the rest running
+            subprocess.run(
+                command + ["--no-recreate", "--remove-orphans", "-d"],
+                check=True,
+            )
+            if changed:
+                cprint(f"\nRecreating changed services: {', '.join(changed)}\n", level=3)
+                subprocess.run(
+                    command + ["--force-recreate", "--no-deps", "-d"] + changed,
+                    check=True,
+                )
+            else:
+                cprint("\nNo service changed, nothing recreated\n", level=2)
         logging.info(f"Docker Compose file generated at ~/{project}-compose.yml")
+        save_compose_state(get_compose_state(project, compose_file_name), applied_file_name)
 
     except Exception as e:
         logging.error("Prod docker-compose failed", exc_info=True)
@@ -293,6 +442,81 @@ def start_prod(
     return db_pass, admin_pass
 
 
+def get_compose_state(project: str, compose_file: str) -> Dict:
+    """
+    {service: {"config": definition, "image_id": local id of its image}} of
+    the compose file, or None when compose can't render it
+    """
+    try:
+        config = json.loads(
+            subprocess.run(
+                ["docker", "compose", "-p", project, "-f", compose_file, "config", "--format", "json"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+    except Exception:
+        logging.error("Reading the compose config failed", exc_info=True)
+        return None
+
+    image_ids = {}
+    for service in config.get("services", {}).values():
+        image = service.get("image")
+        if image and image not in image_ids:
+            inspect = subprocess.run(
+                ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+                capture_output=True,
+                text=True,
+            )
+            image_ids[image] = inspect.stdout.strip() if inspect.returncode == 0 else None
+    return {
+        name: {"config": service, "image_id": image_ids.get(service.get("image"))}
+        for name, service in config.get("services", {}).items()
+    }
+
+
+def load_compose_state(applied_file: str) -> Dict:
+    """
+    the last applied state, None when there is none
+    """
+    if not os.path.exists(applied_file):
+        return None
+    try:
+        with open(applied_file) as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning(f"Ignoring unreadable {applied_file}", exc_info=True)
+        return None
+
+
+def get_changed_services(state: Dict, applied_file: str) -> List[str]:
+    """
+    services whose definition or image differ from the last applied state.
+    None when there is nothing to compare against
+    """
+    applied = load_compose_state(applied_file)
+    if state is None or applied is None:
+        return None
+    return [name for name, service in state.items() if applied.get(name) != service]
+
+
+def save_compose_state(state: Dict, applied_file: str, services: List[str] = None) -> None:
+    """
+    records state as applied. With services, only those are updated: the
+    others keep their last applied state, or stay unrecorded so that
+    --recreate-changed still recreates them
+    """
+    if state is None:
+        return
+    if services is not None:
+        applied = load_compose_state(applied_file) or {}
+        applied.update({name: state[name] for name in services if name in state})
+        state = applied
+    with open(applied_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
 def setup_prod(
     project: str,
     sites: List[str],
@@ -303,6 +527,11 @@ def setup_prod(
     apps: List[str] = [],
     is_https: bool = False,
     http_port: str = None,
+    parallel_sites: int = 1,
+    from_template: bool = False,
+    parallel_pulls: int = 4,
+    recreate_changed: bool = False,
+    force: bool = False,
 ) -> None:
     if len(sites) == 0:
         sites = ["site1.localhost"]
@@ -316,10 +545,14 @@ def setup_prod(
         image=image,
         is_https=is_https,
         http_port=http_port,
+        parallel_pulls=parallel_pulls,
+        recreate_changed=recreate_changed,
     )
 
-    for sitename in sites:
-        create_site(sitename, project, db_pass, admin_pass, apps)
+    if from_template:
+        create_sites_from_template(sites, project, db_pass, admin_pass, apps, parallel_sites, force)
+    else:
+        create_sites(sites, project, db_pass, admin_pass, apps, parallel_sites)
 
     cprint(
         f"MariaDB root password is {db_pass}",
@@ -343,16 +576,31 @@ def update_prod(
     cronstring: str = None,
     is_https: bool = False,
     http_port: str = None,
+    parallel_migrations: int = 1,
+    parallel_pulls: int = 4,
+    recreate_changed: bool = False,
+    rolling: bool = False,
+    drain_timeout: int = None,
 ) -> None:
-    start_prod(
+    if rolling and not get_service_containers(project, "backend"):
+        cprint("\nNo running backend to roll from, recreating all services\n", level=3)
+        rolling = False
+
+    db_pass, _ = start_prod(
         project=project,
         version=version,
         image=image,
         cronstring=cronstring,
         is_https=is_https,
         http_port=http_port,
+        parallel_pulls=parallel_pulls,
+        recreate_changed=recreate_changed,
+        rolling=rolling,
     )
-    migrate_site(project=project)
+    if rolling:
+        rolling_upgrade(project, db_pass, parallel_migrations, drain_timeout or DRAIN_TIMEOUT)
+        return
+    migrate_site(project=project, db_pass=db_pass, parallel=parallel_migrations)
 
 
 def setup_dev_instance(project: str):
@@ -447,7 +695,8 @@ def create_site(
     db_pass: str,
     admin_pass: str,
     apps: List[str] = [],
-):
+    log_file: str = None,
+) -> bool:
     apps = apps or []
     cprint(f"\nCreating site: {sitename} \n", level=3)
     command = [
@@ -456,6 +705,11 @@ def create_site(
         "-p",
         project,
         "exec",
+    ]
+    if log_file:
+        # No TTY: output goes to the site's log file
+        command.append("-T")
+    command += [
         "backend",
         "bench",
         "new-site",
@@ -471,20 +725,461 @@ def create_site(
     command.append(sitename)
 
     try:
-        subprocess.run(
-            command,
+        if log_file:
+            with open(log_file, "w") as log:
+                subprocess.run(
+                    command,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    check=True,
+                )
+        else:
+            subprocess.run(
+                command,
+                check=True,
+            )
+        logging.info(f"New site creation completed for {sitename}")
+        return True
+    except Exception as e:
+        logging.error(f"Bench site creation failed for {sitename}", exc_info=True)
+        cprint(f"Bench Site creation failed for {sitename}\n", e)
+        return False
+
+
+# MariaDB connections one `bench new-site` / `bench migrate` may hold open at once
+CONNECTIONS_PER_SITE_JOB = 10
 
+
+def get_db_connection_headroom(project: str, db_pass: str) -> int:
+    """
+    returns how many more connections MariaDB accepts right now
+    (max_connections - connected threads), or None if it can't be read
+    """
+    query = (
+        "SELECT @@max_connections - VARIABLE_VALUE "
+        "FROM information_schema.GLOBAL_STATUS WHERE VARIABLE_NAME = 'THREADS_CONNECTED'"
+    )
+    try:
+        output = subprocess.run(
+            [
+                "docker",
+                "compose",
+                "-p",
+                project,
+                "exec",
+                "-T",
+                "db",
+                "mariadb",
+                "-uroot",
+                f"-p{db_pass}",
+                "-N",
+                "-e",
+                query,
+            ],
+            capture_output=True,
+            text=True,
             check=True,
+        ).stdout
+        return int(float(output.strip()))
+    except Exception:
+        logging.warning("Could not read MariaDB connection headroom", exc_info=True)
+        return None
+
+
+def get_logs_dir(project: str) -> str:
+    logs_dir = os.path.join(os.path.expanduser("~"), f"{project}-logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    return logs_dir
+
+
+def print_timing_table(title: str, results: List[Dict], label: str = "Site") -> None:
+    """
+    prints one row per site (or image): name, OK / FAILED, seconds and log file
+    """
+    width = max([len(r["name"]) for r in results] + [len(label)])
+    cprint(f"\n{title}", level=3)
+    cprint(f"{label:<{width}}  {'Status':<7}  {'Seconds':>8}  Log", level=3)
+    for r in results:
+        cprint(
+            f"{r['name']:<{width}}  {'OK' if r['ok'] else 'FAILED':<7}  "
+            f"{r['seconds']:>8.1f}  {r.get('log') or '-'}",
+            level=2 if r["ok"] else 1,
         )
-        logging.info("New site creation completed")
+
+
+def run_site_jobs(
+    title: str,
+    sites: List[str],
+    project: str,
+    db_pass: str,
+    parallel: int,
+    job,
+) -> List[Dict]:
+    """
+    runs job(site, log_file) -> bool for every site, up to `parallel` at once,
+    capped by the MariaDB connection headroom. With more than one at a time
+    each site logs to ~/{project}-logs/{title}-{site}.log
+    """
+    parallel = max(1, min(parallel or 1, len(sites)))
+    if parallel > 1 and db_pass:
+        headroom = get_db_connection_headroom(project, db_pass)
+        if headroom is not None:
+            allowed = max(1, headroom // CONNECTIONS_PER_SITE_JOB)
+            if allowed < parallel:
+                cprint(
+                    f"MariaDB has room for {headroom} more connections, "
+                    f"running {allowed} sites at a time instead of {parallel}",
+                    level=3,
+                )
+                parallel = allowed
+
+    logs_dir = get_logs_dir(project) if parallel > 1 else None
+
+    def run(sitename: str) -> Dict:
+        log_file = os.path.join(logs_dir, f"{title}-{sitename}.log") if logs_dir else None
+        started = time.monotonic()
+        ok = job(sitename, log_file)
+        return {
+            "name": sitename,
+            "ok": ok,
+            "seconds": time.monotonic() - started,
+            "log": log_file,
+        }
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        results = list(pool.map(run, sites))
+
+    print_timing_table(f"bench {title}", results)
+    return results
+
+
+def create_sites(
+    sites: List[str],
+    project: str,
+    db_pass: str,
+    admin_pass: str,
+    apps: List[str] = [],
+    parallel: int = 1,
+) -> List[Dict]:
+    return run_site_jobs(
+        "new-site",
+        sites,
+        project,
+        db_pass,
+        parallel,
+        lambda sitename, log_file: create_site(
+            sitename, project, db_pass, admin_pass, apps, log_file=log_file
+        ),
+    )
+
+
+def docker_image_job(action: str, image: str) -> bool:
+    """
+    docker pull / docker push of one image, output kept out of the terminal
+    """
+    try:
+        subprocess.run(
+            [which("docker"), action, "--quiet", image],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"docker {action} {image} failed: {e.stderr}")
+    except Exception:
+        logging.error(f"docker {action} {image} failed", exc_info=True)
+    return False
+
+
+def run_image_jobs(title: str, images: List[str], parallel: int, job) -> List[Dict]:
+    """
+    runs job(image) -> bool for every image, up to `parallel` at once,
+    printing each one as it finishes and a timing table at the end
+    """
+    done = []
+    lock = threading.Lock()
+
+    def run(image: str) -> Dict:
+        started = time.monotonic()
+        ok = job(image)
+        result = {"name": image, "ok": ok, "seconds": time.monotonic() - started}
+        with lock:
+            done.append(result)
+            cprint(
+                f"[{len(done)}/{len(images)}] {title} {image}: "
+                f"{'OK' if ok else 'FAILED'} ({result['seconds']:.1f}s)",
+                level=2 if ok else 1,
+            )
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(images)))) as pool:
+        results = list(pool.map(run, images))
+
+    print_timing_table(f"docker {title}", results, label="Image")
+    return results
+
+
+def list_compose_images(compose_file: str) -> List[str]:
+    with open(compose_file) as f:
+        images = re.findall(r"^\s+image:\s*[\"']?([^\"'\s]+)", f.read(), re.M)
+    return list(dict.fromkeys(images))
+
+
+def pull_compose_images(compose_file: str, parallel: int, refresh: bool = False) -> None:
+    """
+    pulls the images of the compose file that are not present yet, several
+    at once, before `up` would pull them one service at a time. With refresh
+    every image is pulled, so a moved tag (version-16) gets its new image
+    """
+    images = list_compose_images(compose_file)
+    if not refresh:
+        images = [image for image in images if not image_exists_locally(image)]
+    if not images:
+        return
+    cprint(f"\nPulling {len(images)} image(s), {parallel} at a time\n", level=3)
+    run_image_jobs("pull", images, parallel, lambda image: docker_image_job("pull", image))
+
+
+# Site created once per image version and apps, dumped, then dropped
+TEMPLATE_SITE = "template.localhost"
+
+
+def run_logged(command: List[str], log_file: str = None, **kwargs):
+    """
+    subprocess.run(command, check=True), output appended to log_file if given
+    """
+    if not log_file:
+        return subprocess.run(command, check=True, **kwargs)
+    with open(log_file, "a") as log:
+        return subprocess.run(
+            command, stdout=log, stderr=subprocess.STDOUT, check=True, **kwargs
+        )
+
+
+def get_template_dump_path(project: str, apps: List[str]) -> str:
+    """
+    ~/.cache/easy-install/templates/{project}-{key}.sql.gz, key hashed from the
+    image id of the running backend, the app list and `bench version` (app
+    versions and commits), so a moved tag or a new app commit gets a new template
+    """
+    containers = get_service_containers(project, "backend")
+    if not containers:
+        raise RuntimeError("No running backend container")
+    image_id = subprocess.run(
+        ["docker", "inspect", "--format", "{{.Image}}", containers[0]],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    versions = subprocess.run(
+        ["docker", "compose", "-p", project, "exec", "-T", "backend",
+         "bench", "version", "--format", "json"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    inputs = {"image": image_id, "apps": apps or [], "versions": versions}
+    key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+    templates_dir = os.path.join(get_cache_dir(), "templates")
+    os.makedirs(templates_dir, exist_ok=True)
+    return os.path.join(templates_dir, f"{project}-{key}.sql.gz")
+
+
+def get_site_config(project: str, sitename: str) -> Dict:
+    output = subprocess.run(
+        ["docker", "compose", "-p", project, "exec", "-T", "backend",
+         "cat", f"sites/{sitename}/site_config.json"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def build_site_template(
+    project: str,
+    db_pass: str,
+    admin_pass: str,
+    apps: List[str],
+    dump_path: str,
+) -> bool:
+    """
+    creates TEMPLATE_SITE with `bench new-site`, dumps its database to
+    dump_path (gzip), then drops it
+    """
+    cprint(f"\nBuilding site template {os.path.basename(dump_path)}\n", level=3)
+    if not create_site(TEMPLATE_SITE, project, db_pass, admin_pass, apps):
+        return False
+    try:
+        db_name = get_site_config(project, TEMPLATE_SITE)["db_name"]
+        partial = f"{dump_path}.part"
+        dump = subprocess.Popen(
+            ["docker", "compose", "-p", project, "exec", "-T", "db",
+             "mariadb-dump", "-uroot", f"-p{db_pass}",
+             "--single-transaction", "--routines", "--triggers", db_name],
+            stdout=subprocess.PIPE,
+        )
+        with gzip.open(partial, "wb") as out:
+            shutil.copyfileobj(dump.stdout, out)
+        if dump.wait() != 0:
+            raise subprocess.CalledProcessError(dump.returncode, "mariadb-dump")
+        os.replace(partial, dump_path)
+        logging.info(f"Site template written to {dump_path}")
     except Exception as e:
-        logging.error(f"Bench site creation failed for {sitename}", exc_info=True)
-        cprint(f"Bench Site creation failed for {sitename}\n", e)
+        logging.error("Dumping the site template failed", exc_info=True)
+        cprint("Dumping the site template failed\n", e)
+        return False
+    finally:
+        exec_command(
+            project=project,
+            command=["bench", "drop-site", TEMPLATE_SITE, "--no-backup", "--force",
+                     f"--db-root-password={db_pass}"],
+        )
+    return True
+
+
+def clone_site(
+    sitename: str,
+    project: str,
+    db_pass: str,
+    admin_pass: str,
+    dump_path: str,
+    log_file: str = None,
+    force: bool = False,
+) -> bool:
+    """
+    creates sitename from the template dump: new database and user, the dump
+    streamed in, a fresh site_config.json with its own encryption_key, then
+    the post-clone hook (migrate, new Administrator password, cache cleared).
+    An existing site or database is left alone unless force, which drops the
+    database and overwrites the site (also to re-run a clone that failed half way)
+    """
+    cprint(f"\nCloning site: {sitename} \n", level=3)
+    # Same "_" + 16 hex digits shape as `bench new-site` names, but hashed from
+    # the site name: bench hashes the site path, which isn't known here
+    db_name = "_" + hashlib.sha1(sitename.encode()).hexdigest()[:16]
+    site_db_pass = generate_pass(16)
+    compose = ["docker", "compose", "-p", project, "exec", "-T"]
+    mariadb = compose + ["db", "mariadb", "-uroot", f"-p{db_pass}"]
+    try:
+        site_exists = (
+            subprocess.run(
+                compose + ["backend", "test", "-e", f"sites/{sitename}/site_config.json"],
+                capture_output=True,
+            ).returncode
+            == 0
+        )
+        db_exists = bool(
+            subprocess.run(
+                mariadb + ["-N", "-e", f"SELECT 1 FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = '{db_name}'"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+        if (site_exists or db_exists) and not force:
+            existing = f"sites/{sitename}/site_config.json" if site_exists else f"database {db_name}"
+            cprint(f"{existing} already exists, not cloning {sitename} (--force overwrites it)\n", level=1)
+            return False
+        run_logged(
+            mariadb + [
+                "-e",
+                f"DROP DATABASE IF EXISTS `{db_name}`; "
+                f"CREATE DATABASE `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci; "
+                f"CREATE USER IF NOT EXISTS '{db_name}'@'%' IDENTIFIED BY '{site_db_pass}'; "
+                f"ALTER USER '{db_name}'@'%' IDENTIFIED BY '{site_db_pass}'; "
+                f"GRANT ALL PRIVILEGES ON `{db_name}`.* TO '{db_name}'@'%'; "
+                "FLUSH PRIVILEGES;",
+            ],
+            log_file,
+        )
+        with open(log_file, "a") if log_file else open(os.devnull, "w") as log:
+            restore = subprocess.Popen(
+                mariadb + [db_name], stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT
+            )
+            with gzip.open(dump_path, "rb") as dump:
+                shutil.copyfileobj(dump, restore.stdin)
+            restore.stdin.close()
+            if restore.wait() != 0:
+                raise subprocess.CalledProcessError(restore.returncode, "mariadb restore")
+        # Each clone gets its own key (a Fernet key, as `bench new-site` makes).
+        # Values the template encrypted can't be read with it, so they go
+        run_logged(mariadb + [db_name, "-e", "DELETE FROM `__Auth` WHERE encrypted = 1;"], log_file)
+
+        site_config = {
+            "db_name": db_name,
+            "db_password": site_db_pass,
+            "db_type": "mariadb",
+            "encryption_key": base64.urlsafe_b64encode(os.urandom(32)).decode(),
+        }
+        run_logged(
+            compose + [
+                "backend", "sh", "-c",
+                'mkdir -p "sites/$0/private/backups" "sites/$0/private/files" "sites/$0/public/files"'
+                ' && cat > "sites/$0/site_config.json"',
+                sitename,
+            ],
+            log_file,
+            input=json.dumps(site_config, indent=1).encode(),
+        )
+
+        # Post-clone hook; migrate is a no-op unless the template is behind the code
+        run_logged(compose + ["backend", "bench", "--site", sitename, "migrate"], log_file)
+        run_logged(compose + ["backend", "bench", "--site", sitename, "set-admin-password", admin_pass], log_file)
+        run_logged(compose + ["backend", "bench", "--site", sitename, "clear-cache"], log_file)
+        logging.info(f"Site {sitename} cloned from {dump_path}")
+        return True
+    except Exception as e:
+        logging.error(f"Cloning site failed for {sitename}", exc_info=True)
+        cprint(f"Cloning site failed for {sitename}\n", e)
+        return False
+
+
+def create_sites_from_template(
+    sites: List[str],
+    project: str,
+    db_pass: str,
+    admin_pass: str,
+    apps: List[str] = [],
+    parallel: int = 1,
+    force: bool = False,
+) -> List[Dict]:
+    """
+    clones every site from the template of the current image version and apps,
+    building the template first when there is none yet
+    """
+    try:
+        dump_path = get_template_dump_path(project, apps)
+    except Exception as e:
+        logging.error("Reading the image id and app versions failed", exc_info=True)
+        cprint("Reading the image id and app versions failed, creating sites with bench new-site\n", e)
+        return create_sites(sites, project, db_pass, admin_pass, apps, parallel)
+    if not os.path.exists(dump_path):
+        if not build_site_template(project, db_pass, admin_pass, apps, dump_path):
+            cprint("No site template, creating sites with bench new-site", level=3)
+            return create_sites(sites, project, db_pass, admin_pass, apps, parallel)
+    return run_site_jobs(
+        "clone-site",
+        sites,
+        project,
+        db_pass,
+        parallel,
+        lambda sitename, log_file: clone_site(
+            sitename, project, db_pass, admin_pass, dump_path, log_file=log_file, force=force
+        ),
+    )
 
 
-def migrate_site(project: str):
+def migrate_site(project: str, db_pass: str = None, parallel: int = 1):
     cprint(f"\nMigrating sites for {project}", level=3)
 
+    if parallel and parallel > 1:
+        sites = list_sites(project)
+        if sites:
+            return migrate_sites(project, sites, db_pass, parallel)
+
     exec_command(
         project=project,
         command=[
@@ -496,6 +1191,335 @@ def migrate_site(project: str):
     )
 
 
+def list_sites(project: str) -> List[str]:
+    """
+    returns the sites of the bench (folders of sites/ holding a site_config.json)
+    """
+    try:
+        output = subprocess.run(
+            [
+                "docker",
+                "compose",
+                "-p",
+                project,
+                "exec",
+                "-T",
+                "backend",
+                "find",
+                "sites",
+                "-mindepth",
+                "2",
+                "-maxdepth",
+                "2",
+                "-name",
+                "site_config.json",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except Exception as e:
+        logging.error(f"Listing sites failed for {project}", exc_info=True)
+        cprint(f"Listing sites failed for {project}\n", e)
+        return []
+    return sorted(line.split("/")[1] for line in output.splitlines() if line.strip())
+
+
+def migrate_one_site(
+    project: str, sitename: str, log_file: str = None, container: str = None
+) -> bool:
+    # bench migrate puts only this site in maintenance mode, and takes it
+    # out as soon as this site is done
+    if container:
+        # A given backend container (rolling upgrade: the new one)
+        command = ["docker", "exec", container]
+    else:
+        command = ["docker", "compose", "-p", project, "exec"]
+        if log_file:
+            command.append("-T")
+        command.append("backend")
+    command += ["bench", "--site", sitename, "migrate"]
+    try:
+        if log_file:
+            with open(log_file, "w") as log:
+                subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, check=True)
+        else:
+            subprocess.run(command, check=True)
+        logging.info(f"Migration completed for {sitename}")
+        return True
+    except Exception as e:
+        logging.error(f"Migration failed for {sitename}", exc_info=True)
+        cprint(f"Migration failed for {sitename}\n", e)
+        return False
+
+
+def migrate_sites(
+    project: str,
+    sites: List[str],
+    db_pass: str = None,
+    parallel: int = 1,
+    container: str = None,
+) -> List[Dict]:
+    """
+    migrates each site in its own backend exec session, up to `parallel` at once;
+    every site is back online as soon as its own migration ends
+    """
+    return run_site_jobs(
+        "migrate",
+        sites,
+        project,
+        db_pass,
+        parallel,
+        lambda sitename, log_file: migrate_one_site(project, sitename, log_file, container),
+    )
+
+
+# Rolling upgrade: services started next to their old containers, in order
+ROLLING_WEB_SERVICES = ["backend", "websocket"]
+ROLLING_WORKER_SERVICES = ["queue-short", "queue-long"]
+# Everything rolling_upgrade() recreates; db / redis / proxy are left running
+ROLLED_SERVICES = (
+    ROLLING_WEB_SERVICES + ["frontend"] + ROLLING_WORKER_SERVICES + ["configurator", "scheduler", "cron"]
+)
+ROLLING_HEALTH_TIMEOUT = 180
+# Time for traefik to pick up a new frontend from docker events (throttled to 2s)
+TRAEFIK_SETTLE_SECONDS = 5
+WEB_STOP_TIMEOUT = 30
+DRAIN_TIMEOUT = 300
+
+
+def get_service_containers(project: str, service: str) -> List[str]:
+    try:
+        output = subprocess.run(
+            ["docker", "compose", "-p", project, "ps", "-q", service],
+            capture_output=True,
+            text=True,
+        ).stdout
+    except Exception:
+        logging.error(f"Listing {service} containers failed", exc_info=True)
+        return []
+    return [line.strip() for line in output.splitlines() if line.strip()]
+
+
+def get_health_check(service: str, sitename: str = None) -> str:
+    port = {"backend": 8000, "websocket": 9000, "frontend": 8080}[service]
+    if sitename and service != "websocket":
+        return f"curl -sf -o /dev/null -H 'Host: {sitename}' http://127.0.0.1:{port}/api/method/ping"
+    return f"wait-for-it -q -t 2 127.0.0.1:{port}"
+
+
+def wait_healthy(containers: List[str], check: str, timeout: int = ROLLING_HEALTH_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    pending = list(containers)
+    while pending:
+        pending = [
+            container
+            for container in pending
+            if subprocess.run(
+                ["docker", "exec", container, "sh", "-c", check], capture_output=True
+            ).returncode
+            != 0
+        ]
+        if pending and time.monotonic() > deadline:
+            return False
+        if pending:
+            time.sleep(2)
+    return True
+
+
+def scale_up_services(project: str, compose_file: str, services: List[str]) -> Dict[str, List[str]]:
+    """
+    starts one new container (current compose definition) next to each
+    running one. Returns the new container ids per service
+    """
+    old = {service: get_service_containers(project, service) for service in services}
+    command = ["docker", "compose", "-p", project, "-f", compose_file, "up", "-d", "--no-deps", "--no-recreate"]
+    for service in services:
+        command += ["--scale", f"{service}={max(1, len(old[service]) * 2)}"]
+    subprocess.run(command + services, check=True)
+    return {
+        service: [c for c in get_service_containers(project, service) if c not in old[service]]
+        for service in services
+    }
+
+
+def get_published_ports(state: Dict, service: str) -> List[str]:
+    """
+    host ports the service publishes (compose.noproxy.yaml, --no-ssl).
+    Empty behind traefik
+    """
+    if not state or service not in state:
+        return []
+    return [
+        str(port["published"])
+        for port in state[service]["config"].get("ports", [])
+        if isinstance(port, dict) and port.get("published")
+    ]
+
+
+def stop_containers(containers: List[str], timeout: int, stop_signal: str = None) -> None:
+    """
+    SIGTERM (or stop_signal), up to `timeout` seconds to finish (gunicorn
+    requests, rq jobs), then remove
+    """
+    if not containers:
+        return
+    command = ["docker", "stop", "-t", str(timeout)]
+    if stop_signal:
+        command += ["--signal", stop_signal]
+    subprocess.run(command + containers, check=True)
+    subprocess.run(["docker", "rm"] + containers, check=True)
+
+
+def roll_services(
+    project: str, compose_file: str, services: List[str], sitename: str = None
+) -> Dict[str, List[str]]:
+    """
+    new containers for services, health checked when a check exists.
+    On failure the new containers are removed and the upgrade stops,
+    the old ones keep serving
+    """
+    cprint(f"\nStarting new {', '.join(services)}\n", level=3)
+    new = {}
+    try:
+        new = scale_up_services(project, compose_file, services)
+        for service, containers in new.items():
+            if not containers:
+                raise RuntimeError(f"Scaling up {service} started no new container")
+            if service in ("backend", "websocket", "frontend") and not wait_healthy(
+                containers, get_health_check(service, sitename)
+            ):
+                raise RuntimeError(f"New {service} not healthy after {ROLLING_HEALTH_TIMEOUT}s")
+    except Exception as e:
+        logging.error(f"Rolling {services} failed", exc_info=True)
+        cprint("\nRolling upgrade failed, old containers are still serving\n\n", "[ERROR]: ", e, level=1)
+        stop_containers([c for containers in new.values() for c in containers], 0)
+        sys.exit(1)
+    return new
+
+
+def rolling_upgrade(
+    project: str,
+    db_pass: str = None,
+    parallel_migrations: int = 1,
+    drain_timeout: int = DRAIN_TIMEOUT,
+) -> None:
+    """
+    replaces the app containers without taking the bench offline:
+      1. configurator refreshes apps.txt / common config from the new image
+      2. new backend + websocket next to the old ones, health checked
+      3. per-site migrations in the new backend (each site in maintenance
+         mode only while its own migration runs)
+      4. new frontend, traefik adds it, old frontend stopped. A frontend
+         publishing a host port (--no-ssl) can't run twice: it is
+         replaced in place instead, a few seconds without a frontend
+      5. old backend + websocket drained, new frontend nginx reloaded
+      6. new queue workers, old ones get drain_timeout to finish their jobs
+      7. scheduler and cron recreated (never two schedulers at once)
+    """
+    compose_file_name = os.path.join(os.path.expanduser("~"), f"{project}-compose.yml")
+    applied_file_name = os.path.join(os.path.expanduser("~"), f"{project}-compose.applied.json")
+    compose = ["docker", "compose", "-p", project, "-f", compose_file_name]
+    state = get_compose_state(project, compose_file_name)
+    not_rolled = [
+        service
+        for service in get_changed_services(state, applied_file_name) or []
+        if service not in ROLLED_SERVICES
+    ]
+    # Checked before anything is migrated: a second frontend could not bind
+    # the same host port
+    frontend_ports = get_published_ports(state, "frontend")
+    if frontend_ports:
+        cprint(
+            f"\nfrontend publishes host port {', '.join(frontend_ports)} (no proxy): it is replaced "
+            "in place after the migrations, the site is unreachable until the new one is up\n",
+            level=3,
+        )
+    if not_rolled:
+        cprint(
+            f"\n{', '.join(not_rolled)} changed but a rolling upgrade leaves them running. "
+            "Run upgrade with --recreate-changed afterwards to apply them\n",
+            level=3,
+        )
+    old = {
+        service: get_service_containers(project, service)
+        for service in ROLLING_WEB_SERVICES + ["frontend"] + ROLLING_WORKER_SERVICES
+    }
+    sites = list_sites(project)
+    sitename = sites[0] if sites else None
+
+    try:
+        # Infra services keep running; anything missing is created
+        subprocess.run(compose + ["up", "-d", "--no-recreate", "--remove-orphans"], check=True)
+        subprocess.run(
+            compose
+            + ["up", "--no-deps", "--force-recreate", "--exit-code-from", "configurator", "configurator"],
+            check=True,
+        )
+    except Exception as e:
+        logging.error("Rolling upgrade: configurator failed", exc_info=True)
+        cprint("\nConfigurator failed, nothing was replaced\n\n", "[ERROR]: ", e, level=1)
+        sys.exit(1)
+
+    new = roll_services(project, compose_file_name, ROLLING_WEB_SERVICES, sitename)
+
+    if sites:
+        cprint(f"\nMigrating sites for {project} in the new backend", level=3)
+        results = migrate_sites(
+            project, sites, db_pass, parallel_migrations, container=new["backend"][0]
+        )
+        if not all(r["ok"] for r in results):
+            # The old code keeps serving; sites that did migrate run on it until
+            # the failure is fixed and the upgrade is run again
+            cprint(
+                "\nSome migrations failed, see the table above. Removing the new "
+                f"{', '.join(ROLLING_WEB_SERVICES)}, the old containers keep serving\n",
+                level=1,
+            )
+            stop_containers([c for service in ROLLING_WEB_SERVICES for c in new[service]], 0)
+            sys.exit(1)
+
+    try:
+        if frontend_ports:
+            cprint("\nReplacing frontend in place\n", level=3)
+            # SIGQUIT is nginx's graceful shutdown: open requests are finished,
+            # SIGTERM would drop them
+            stop_containers(old["frontend"], WEB_STOP_TIMEOUT, stop_signal="SIGQUIT")
+            subprocess.run(compose + ["up", "-d", "--no-deps", "frontend"], check=True)
+            new["frontend"] = get_service_containers(project, "frontend")
+            if not wait_healthy(new["frontend"], get_health_check("frontend", sitename)):
+                raise RuntimeError(f"New frontend not healthy after {ROLLING_HEALTH_TIMEOUT}s")
+        else:
+            new.update(roll_services(project, compose_file_name, ["frontend"], sitename))
+            time.sleep(TRAEFIK_SETTLE_SECONDS)
+            cprint("\nSwitching traffic to the new containers\n", level=3)
+            stop_containers(old["frontend"], WEB_STOP_TIMEOUT, stop_signal="SIGQUIT")
+        # gunicorn stops accepting on SIGTERM, nginx retries refused
+        # requests on the new backend; reload drops the old addresses
+        stop_containers(old["backend"] + old["websocket"], WEB_STOP_TIMEOUT)
+        for container in new["frontend"]:
+            subprocess.run(["docker", "exec", container, "nginx", "-s", "reload"], check=True)
+
+        roll_services(project, compose_file_name, ROLLING_WORKER_SERVICES)
+        cprint(f"\nDraining old workers (up to {drain_timeout}s)\n", level=3)
+        stop_containers(
+            [c for service in ROLLING_WORKER_SERVICES for c in old[service]], drain_timeout
+        )
+        subprocess.run(
+            compose + ["up", "-d", "--no-deps", "--force-recreate", "scheduler", "cron"],
+            check=True,
+        )
+    except Exception as e:
+        logging.error("Rolling upgrade failed", exc_info=True)
+        cprint("\nRolling upgrade failed, please check the containers\n\n", "[ERROR]: ", e, level=1)
+        sys.exit(1)
+
+    # Only what was recreated counts as applied, so --recreate-changed still
+    # picks up changed db / redis / proxy definitions
+    save_compose_state(state, applied_file_name, ROLLED_SERVICES)
+    cprint("\nRolling upgrade completed\n", level=2)
+
+
 def exec_command(project: str, command: List[str] = [], interactive_terminal=False):
     if not command:
         command = ["echo", '"Please execute a command"']
@@ -556,6 +1580,24 @@ def add_setup_options(parser: argparse.ArgumentParser):
         dest="sites",
     )
     parser.add_argument("-e", "--email", help="Add email for the SSL.")
+    parser.add_argument(
+        "--parallel-sites",
+        type=int,
+        default=1,
+        help="Create up to N sites at once (capped by MariaDB connections), default: 1",
+    )
+    parser.add_argument(
+        "--from-template",
+        action="store_true",
+        help="Clone new sites from a template database dump of this image version "
+        "instead of installing the apps on each site",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="With --from-template, overwrite a site or database that already exists "
+        "(its data is lost) instead of skipping it",
+    )
 
     return parser
 
@@ -584,6 +1626,45 @@ def add_common_parser(parser: argparse.ArgumentParser):
         action="store_true",
         help="Force pull frappe_docker",
     )
+    parser.add_argument(
+        "--frappe-docker-ref",
+        help="frappe_docker branch, tag or commit to use, default: main. "
+        "Archives are cached in ~/.cache/easy-install",
+    )
+    parser.add_argument(
+        "--parallel-pulls",
+        type=int,
+        default=4,
+        help="Pull up to N missing compose images at once before starting, 0 leaves pulling to compose, default: 4",
+    )
+    parser.add_argument(
+        "--recreate-changed",
+        action="store_true",
+        help="Pull every compose image, then recreate only services whose definition or image "
+        "changed since the last applied compose (~/<project>-compose.applied.json) instead of all of them",
+    )
+    return parser
+
+
+def add_upgrade_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--parallel-migrations",
+        type=int,
+        default=1,
+        help="Migrate up to N sites at once, one exec session each, default: 1 (bench --site all migrate)",
+    )
+    parser.add_argument(
+        "--rolling",
+        action="store_true",
+        help="Zero-downtime upgrade: start new app containers next to the old ones, migrate per site, "
+        "switch traffic, then drain the old ones",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=int,
+        default=DRAIN_TIMEOUT,
+        help=f"Seconds old queue workers get to finish their jobs in a rolling upgrade, default: {DRAIN_TIMEOUT}",
+    )
     return parser
 
 
@@ -591,6 +1672,7 @@ def add_build_parser(subparsers: argparse.ArgumentParser):
     parser = subparsers.add_parser("build", help="Build custom images")
     parser = add_common_parser(parser)
     parser = add_setup_options(parser)
+    parser = add_upgrade_options(parser)
     parser.add_argument(
         "-p",
         "--push",
@@ -640,6 +1722,29 @@ def add_build_parser(subparsers: argparse.ArgumentParser):
         help="NodeJS Version, default: 24.1.0",
         default="24.1.0",
     )
+    parser.add_argument(
+        "--layered",
+        action="store_true",
+        help="Install every apps.json entry in its own cached stage (custom apps last) instead of one bench init",
+    )
+    parser.add_argument(
+        "--cache-from",
+        action="append",
+        default=[],
+        help="Build with buildx and import cache from a local directory or registry ref (repeatable), "
+        "e.g. ~/.cache/easy-install/buildkit or registry.example.com/frappe-hrms:buildcache",
+    )
+    parser.add_argument(
+        "--cache-to",
+        action="append",
+        default=[],
+        help="Build with buildx and export cache (mode=max) to a local directory or registry ref (repeatable)",
+    )
+    parser.add_argument(
+        "--force-build",
+        action="store_true",
+        help="Build even if an image with the same build inputs hash exists",
+    )
     parser.add_argument(
         "-x",
         "--deploy",
@@ -670,6 +1775,7 @@ def add_develop_parser(subparsers: argparse.ArgumentParser):
 def add_upgrade_parser(subparsers: argparse.ArgumentParser):
     parser = subparsers.add_parser("upgrade", help="Upgrade existing project")
     parser = add_common_parser(parser)
+    parser = add_upgrade_options(parser)
 
 
 def add_exec_parser(subparsers: argparse.ArgumentParser):
@@ -677,6 +1783,210 @@ def add_exec_parser(subparsers: argparse.ArgumentParser):
     parser = add_project_option(parser)
 
 
+# Image label holding the build-inputs hash
+BUILD_INPUTS_LABEL = "io.easy-install.build-inputs"
+BUILDX_BUILDER = "easy-install"
+
+
+def resolve_git_branch(url: str, branch: str) -> Optional[str]:
+    """
+    returns the commit branch points to (git ls-remote), or None when it
+    can't be resolved
+    """
+    try:
+        output = subprocess.run(
+            ["git", "ls-remote", url, branch],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=60,
+        ).stdout
+        if output.strip():
+            return output.split()[0]
+    except Exception:
+        logging.warning(f"Could not resolve {branch} of {url}", exc_info=True)
+    return None
+
+
+def get_build_inputs_hash(
+    frappe_path: str,
+    frappe_branch: str,
+    containerfile_path: str,
+    apps_json: bytes,
+    python_version: str,
+    node_version: str,
+) -> str:
+    """
+    sha256 over everything that goes into the image: Containerfile, apps.json,
+    frappe_docker commit, build args and the commits the branches point to.
+    Raises ValueError when a branch can't be resolved: the inputs are unknown
+    then, so the image has to be built
+    """
+    with open(os.path.join(get_frappe_docker_path(), containerfile_path), "rb") as f:
+        containerfile = f.read()
+    try:
+        apps = json.loads(apps_json)
+    except ValueError:
+        apps = []
+    refs = [[frappe_path, frappe_branch]] + [[app.get("url"), app.get("branch")] for app in apps]
+    commits = [resolve_git_branch(url, branch) for url, branch in refs]
+    unresolved = [f"{url} ({branch})" for (url, branch), commit in zip(refs, commits) if not commit]
+    if unresolved:
+        raise ValueError(f"Could not resolve {', '.join(unresolved)}")
+    inputs = {
+        "containerfile": hashlib.sha256(containerfile).hexdigest(),
+        "apps_json": hashlib.sha256(apps_json).hexdigest(),
+        "frappe_docker": get_frappe_docker_commit() or "",
+        "frappe_path": frappe_path,
+        "frappe_branch": frappe_branch,
+        "frappe_commit": commits[0],
+        "apps": [[app.get("url"), app.get("branch"), commit] for app, commit in zip(apps, commits[1:])],
+        "python_version": python_version,
+        "node_version": node_version,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def get_image_repository(tag: str) -> str:
+    name, _, version = tag.rpartition(":")
+    # "registry:5000/image" has a ":" but no tag
+    return name if name and "/" not in version else tag
+
+
+def image_exists_locally(image: str) -> bool:
+    return (
+        subprocess.run(
+            [which("docker"), "image", "inspect", image],
+            capture_output=True,
+        ).returncode
+        == 0
+    )
+
+
+def image_exists_in_registry(image: str) -> bool:
+    return (
+        subprocess.run(
+            [which("docker"), "manifest", "inspect", image],
+            capture_output=True,
+        ).returncode
+        == 0
+    )
+
+
+def get_cache_spec(spec: str, export: bool) -> str:
+    """
+    buildx --cache-from / --cache-to value. Full specs (type=...) pass through,
+    a path becomes a local cache and anything else a registry cache ref
+    """
+    if "type=" in spec:
+        return spec
+    if spec.startswith(("/", ".", "~")):
+        path = os.path.abspath(os.path.expanduser(spec))
+        return f"type=local,dest={path},mode=max" if export else f"type=local,src={path}"
+    return f"type=registry,ref={spec},mode=max" if export else f"type=registry,ref={spec}"
+
+
+def get_buildx_builder() -> str:
+    """
+    cache export needs a docker-container builder, the default docker driver
+    can't write --cache-to. Returns None when buildx is not usable
+    """
+    if (
+        subprocess.run(
+            [which("docker"), "buildx", "inspect", BUILDX_BUILDER],
+            capture_output=True,
+        ).returncode
+        == 0
+    ):
+        return BUILDX_BUILDER
+    cprint(f"Creating buildx builder {BUILDX_BUILDER}", level=3)
+    try:
+        subprocess.run(
+            [
+                which("docker"),
+                "buildx",
+                "create",
+                "--name",
+                BUILDX_BUILDER,
+                "--driver",
+                "docker-container",
+            ],
+            check=True,
+        )
+    except Exception as e:
+        logging.error("Creating buildx builder failed", exc_info=True)
+        cprint("\nCreating buildx builder failed, building without cache\n\n", "[ERROR]: ", e, level=1)
+        return None
+    return BUILDX_BUILDER
+
+
+def is_custom_app(app: dict) -> bool:
+    """
+    "custom" in the apps.json entry, otherwise anything outside the frappe
+    GitHub org counts as custom
+    """
+    if "custom" in app:
+        return bool(app["custom"])
+    return not (app.get("url") or "").startswith("https://github.com/frappe/")
+
+
+def write_layered_containerfile(containerfile_path: str, apps: List[dict]) -> str:
+    """
+    writes <containerfile>.layered: the builder stage runs bench init with
+    frappe only, then every apps.json entry gets its own stage (custom apps
+    last, apps.json order otherwise) and one final stage builds the assets.
+    The backend stage copies the bench from that final stage.
+    Returns the path relative to frappe_docker
+    """
+    with open(os.path.join(get_frappe_docker_path(), containerfile_path)) as f:
+        containerfile = f.read()
+    builder = re.search(r"^FROM\s+\S+\s+AS\s+builder\s*$", containerfile, re.M | re.I)
+    next_stage = builder and re.search(r"^FROM\s", containerfile[builder.end() :], re.M)
+    if not next_stage:
+        raise ValueError(f"No builder stage followed by another stage in {containerfile_path}")
+    split_at = builder.end() + next_stage.start()
+
+    cache_mount = "--mount=type=cache,target=/home/frappe/.cache,uid=1000,gid=1000"
+    stages = []
+    parent = "builder"
+    for app in sorted(apps, key=is_custom_app):
+        url, branch = app["url"], app.get("branch")
+        name = app.get("name") or re.sub(r"\.git$", "", url.rstrip("/").split("/")[-1])
+        stage = "app-" + re.sub(r"[^a-z0-9_.-]", "-", name.lower())
+        # The resolved commit is part of the instruction: a new commit on the
+        # same branch invalidates this layer (and the ones after it) only.
+        # An unresolved branch gets a one-off value so the layer is rebuilt
+        commit = resolve_git_branch(url, branch or "HEAD") or f"unresolved-{int(time.time())}"
+        branch_arg = f"--branch={branch} " if branch else ""
+        stages.append(
+            f"FROM {parent} AS {stage}\n"
+            "WORKDIR /home/frappe/frappe-bench\n"
+            f"RUN {cache_mount} \\\n"
+            f'  echo "{name}: {branch or "HEAD"} @ {commit}" && \\\n'
+            f"  bench get-app --skip-assets {branch_arg}{url}\n"
+        )
+        parent = stage
+    stages.append(
+        f"FROM {parent} AS apps\n"
+        "WORKDIR /home/frappe/frappe-bench\n"
+        f"RUN {cache_mount} \\\n"
+        "  bench build && \\\n"
+        '  find apps -mindepth 1 -path "*/.git" | xargs rm -fr\n'
+    )
+
+    runtime = re.sub(r"--from=builder\b", "--from=apps", containerfile[split_at:])
+    layered_path = f"{containerfile_path}.layered"
+    with open(os.path.join(get_frappe_docker_path(), layered_path), "w") as f:
+        f.write(
+            containerfile[:split_at].rstrip()
+            + "\n\n# Per-app layers generated by easy-install.py build --layered\n\n"
+            + "\n".join(stages)
+            + "\n"
+            + runtime
+        )
+    return layered_path
+
+
 def build_image(
     push: bool,
     frappe_path: str,
@@ -686,6 +1996,10 @@ def build_image(
     tags: List[str],
     python_version: str,
     node_version: str,
+    force_build: bool = False,
+    cache_from: List[str] = None,
+    cache_to: List[str] = None,
+    layered: bool = False,
 ):
     if not check_repo_exists():
         clone_frappe_docker_repo()
@@ -695,6 +2009,7 @@ def build_image(
         tags = ["custom-apps:latest"]
 
     apps_json_base64 = None
+    file_read = b""
     try:
         with open(apps_json_path, "rb") as file_text:
             file_read = file_text.read()
@@ -705,15 +2020,76 @@ def build_image(
         logging.error("Unable to base64 encode apps.json", exc_info=True)
         cprint("\nUnable to base64 encode apps.json\n\n", "[ERROR]: ", e, level=1)
 
-    command = [
-        which("docker"),
-        "build",
-        "--progress=plain",
-    ]
+    if layered:
+        try:
+            containerfile_path = write_layered_containerfile(
+                containerfile_path, json.loads(file_read)
+            )
+            # bench init installs frappe only, the apps come from their own stages
+            apps_json_base64 = ""
+            cprint(f"Layered build using {containerfile_path}", level=3)
+        except Exception as e:
+            logging.error("Generating the layered Containerfile failed", exc_info=True)
+            cprint("\nGenerating the layered Containerfile failed, building with apps.json\n\n", "[ERROR]: ", e, level=1)
 
-    for tag in tags:
+    hash_tags = []
+    try:
+        inputs_hash = get_build_inputs_hash(
+            frappe_path=frappe_path,
+            frappe_branch=frappe_branch,
+            containerfile_path=containerfile_path,
+            apps_json=file_read,
+            python_version=python_version,
+            node_version=node_version,
+        )
+        # Deterministic tag: same inputs, same tag
+        hash_tags = [f"{get_image_repository(tags[0])}:build-{inputs_hash[:12]}"]
+        cprint(f"Build inputs hash: {inputs_hash[:12]} ({hash_tags[0]})", level=3)
+    except Exception as e:
+        logging.error("Hashing the build inputs failed", exc_info=True)
+        cprint("\nHashing the build inputs failed, building anyway\n\n", "[ERROR]: ", e, level=1)
+
+    if hash_tags and not force_build and reuse_built_image(hash_tags[0], tags, push):
+        return
+
+    cache_from = cache_from or []
+    cache_to = cache_to or []
+    # local cache dirs are exported next to the old one and swapped in after
+    # the build, buildx never prunes blobs of a local cache by itself
+    local_caches = []
+    builder = get_buildx_builder() if cache_from or cache_to else None
+    if builder:
+        command = [
+            which("docker"),
+            "buildx",
+            "build",
+            f"--builder={builder}",
+            "--progress=plain",
+            "--load",
+        ]
+        for spec in cache_from:
+            command.append(f"--cache-from={get_cache_spec(spec, export=False)}")
+        for spec in cache_to:
+            spec = get_cache_spec(spec, export=True)
+            match = re.search(r"(?:^|,)dest=([^,]+)", spec)
+            if spec.startswith("type=local") and match:
+                local_caches.append(match.group(1))
+                shutil.rmtree(f"{match.group(1)}.new", ignore_errors=True)
+                spec = spec.replace(f"dest={match.group(1)}", f"dest={match.group(1)}.new")
+            command.append(f"--cache-to={spec}")
+    else:
+        command = [
+            which("docker"),
+            "build",
+            "--progress=plain",
+        ]
+
+    for tag in tags + hash_tags:
         command.append(f"--tag={tag}")
 
+    if hash_tags:
+        command.append(f"--label={BUILD_INPUTS_LABEL}={inputs_hash}")
+
     command += [
         f"--file={containerfile_path}",
         f"--build-arg=FRAPPE_PATH={frappe_path}",
@@ -730,20 +2106,53 @@ def build_image(
             check=True,
             cwd="frappe_docker",
         )
+        for path in local_caches:
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(f"{path}.new", path)
     except Exception as e:
         logging.error("Image build failed", exc_info=True)
         cprint("\nImage build failed\n\n", "[ERROR]: ", e, level=1)
 
     if push:
-        try:
+        # Tags of one image share their layers: pushing them together uploads each layer once
+        results = run_image_jobs(
+            "push", tags + hash_tags, len(tags + hash_tags), lambda tag: docker_image_job("push", tag)
+        )
+        if not all(r["ok"] for r in results):
+            cprint("\nImage push failed, see easy-install.log\n", level=1)
+
+
+def reuse_built_image(hash_tag: str, tags: List[str], push: bool) -> bool:
+    """
+    points tags at an existing image built from the same inputs (local or in
+    the registry). Returns False when there is none and a build is needed
+    """
+    in_registry = push and image_exists_in_registry(hash_tag)
+    local = image_exists_locally(hash_tag)
+    if not local and not in_registry:
+        return False
+
+    cprint(f"\nImage with identical build inputs exists ({hash_tag}), skipping build\n", level=2)
+    logging.info(f"Skipping build, reusing {hash_tag}")
+    try:
+        if local:
+            for tag in tags:
+                subprocess.run([which("docker"), "tag", hash_tag, tag], check=True)
+        if in_registry:
+            # Re-tag inside the registry: no layers are pushed again
             for tag in tags:
                 subprocess.run(
-                    [which("docker"), "push", tag],
+                    [which("docker"), "buildx", "imagetools", "create", "--tag", tag, hash_tag],
                     check=True,
                 )
-        except Exception as e:
-            logging.error("Image push failed", exc_info=True)
-            cprint("\nImage push failed\n\n", "[ERROR]: ", e, level=1)
+        elif push:
+            run_image_jobs(
+                "push", tags + [hash_tag], len(tags) + 1, lambda tag: docker_image_job("push", tag)
+            )
+    except Exception as e:
+        logging.error("Tagging the existing image failed", exc_info=True)
+        cprint("\nTagging the existing image failed\n\n", "[ERROR]: ", e, level=1)
+    return True
 
 
 def get_args_parser():
@@ -783,6 +2192,16 @@ if __name__ == "__main__":
         cprint("\nForce pull frappe_docker again\n", level=2)
         shutil.rmtree(get_frappe_docker_path(), ignore_errors=True)
 
+    frappe_docker_ref = getattr(args, "frappe_docker_ref", None)
+    if frappe_docker_ref and check_repo_exists():
+        wanted_commit = resolve_frappe_docker_ref(frappe_docker_ref)
+        if wanted_commit and get_frappe_docker_commit() != wanted_commit:
+            cprint(f"\nSwitching frappe_docker to {frappe_docker_ref}\n", level=2)
+            shutil.rmtree(get_frappe_docker_path(), ignore_errors=True)
+
+    if args.subcommand != "exec" and not check_repo_exists():
+        clone_frappe_docker_repo(frappe_docker_ref or FRAPPE_DOCKER_REF)
+
     if args.subcommand == "build":
         build_image(
             push=args.push,
@@ -793,6 +2212,10 @@ if __name__ == "__main__":
             containerfile_path=args.containerfile,
             python_version=args.python_version,
             node_version=args.node_version,
+            force_build=args.force_build,
+            cache_from=args.cache_from,
+            cache_to=args.cache_to,
+            layered=args.layered,
         )
         if args.deploy:
             setup_prod(
@@ -805,6 +2228,11 @@ if __name__ == "__main__":
                 apps=args.apps,
                 is_https=not args.no_ssl,
                 http_port=args.http_port,
+                parallel_sites=args.parallel_sites,
+                from_template=args.from_template,
+                parallel_pulls=args.parallel_pulls,
+                recreate_changed=args.recreate_changed,
+                force=args.force,
             )
         elif args.upgrade:
             update_prod(
@@ -814,6 +2242,11 @@ if __name__ == "__main__":
                 cronstring=args.backup_schedule,
                 is_https=not args.no_ssl,
                 http_port=args.http_port,
+                parallel_migrations=args.parallel_migrations,
+                parallel_pulls=args.parallel_pulls,
+                recreate_changed=args.recreate_changed,
+                rolling=args.rolling,
+                drain_timeout=args.drain_timeout,
             )
 
     elif args.subcommand == "deploy":
@@ -832,6 +2265,11 @@ if __name__ == "__main__":
             apps=args.apps,
             is_https=not args.no_ssl,
             http_port=args.http_port,
+            parallel_sites=args.parallel_sites,
+            from_template=args.from_template,
+            parallel_pulls=args.parallel_pulls,
+            recreate_changed=args.recreate_changed,
+            force=args.force,
         )
     elif args.subcommand == "develop":
         cprint("\nSetting Up Development Instance\n", level=2)
@@ -847,6 +2285,11 @@ if __name__ == "__main__":
             is_https=not args.no_ssl,
             cronstring=args.backup_schedule,
             http_port=args.http_port,
+            parallel_migrations=args.parallel_migrations,
+            parallel_pulls=args.parallel_pulls,
+            recreate_changed=args.recreate_changed,
+            rolling=args.rolling,
+            drain_timeout=args.drain_timeout,
         )
     elif args.subcommand == "exec":
         cprint(f"\nExec into {args.project} backend\n", level=2)
@@ -0,0 +1,479 @@
+# Server Script: HR Data Access
+# Script Type: API
+# API Method: hr_data_access
+# NOTE: Do NOT use import statements in Server Scripts - modules are pre-loaded
+#
+# Bulk, window-scoped loaders shared by the GVS scripts. Load it with
+#     hr = run_script("HR Data Access")
+#     hr.bind_run(telemetry, run)    # optional: count reads on the HR Script Run
+# Each loader takes the whole employee list and a date window and issues one
+# query (two for shifts). Results are memoised until the end of the run: a
+# run_script call gets its own copy of this script, so the memo never outlives
+# the script that loaded it.
+
+memo = {}
+bound = {}
+
+# Shift Type late_entry_grace_period when empty (also in get_numbered_late_days)
+DEFAULT_GRACE_MINUTES = 10
+# One row per (employee, notice_date, notice_type), see setup/hr-notice-ledger.md
+NOTICE_LEDGER = "HR Notice Ledger"
+
+# Email Template record (Use HTML, Jinja) holding the late entry notice.
+# DEFAULT_LATE_ENTRY_SUBJECT / DEFAULT_LATE_ENTRY_TEMPLATE are used until it exists.
+LATE_ENTRY_EMAIL_TEMPLATE = "Late Entry Notice"
+DEFAULT_LATE_ENTRY_SUBJECT = "Late Entry Notice - {{ attendance_date }}"
+DEFAULT_LATE_ENTRY_TEMPLATE = """
+<body style="font-family: Arial, sans-serif; margin: 0; padding: 0">
+  <div class="container" style="max-width: 600px; background-color: white; margin: 0 auto; border-radius: 10px;">
+    <div class="container-body" style="padding: 32px 24px; background-color: #eaf1fe; border-radius: 12px;">
+      <div class="header" style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 24px;">
+        <div class="logo">
+          <img src="https://pw-images-dev.s3.ap-south-2.amazonaws.com/PWLogoForEmailV3.png" alt="PossibleWorks Logo" style="height:40px"/>
+        </div>
+      </div>
+      <div class="content" style="color: #0f1e3d; border-radius: 12px">
+        <h2 style="font-size: 20px; font-weight: 500; color: #0f1e3d;">
+          Hey {{ emp_first_name }},
+        </h2>
+        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
+          This is to inform you that your check-in on <strong>{{ attendance_date }}</strong>
+          was recorded as a late entry.
+        </p>
+        <ul style="color: #3d475c; font-size: 14px; font-weight: 400; padding-left: 20px;">
+          <li><strong>Shift Start Time:</strong> {{ shift_start }}</li>
+          <li><strong>Your First Check-in:</strong> {{ first_in }}</li>
+          <li><strong>Late Entry Count (This Month):</strong> {{ late_number }}</li>
+        </ul>
+        {% if is_fourth_late %}<p style='color:#b3261e;font-size:14px;font-weight:500;'>Please note: This is your 4th late entry for this month. As per policy, today has been marked for HR review.</p>{% endif %}
+        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
+          If you believe this is an error, please reach out to your HR team.
+        </p>
+        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
+          Best regards,<br>HR Team
+        </p>
+      </div>
+    </div>
+    <div class="footer" style="text-align: center; padding: 32px 20px; background-color: white; font-size: 12px; color: #2e5cb8; font-weight: 400;">
+      <p>This email was sent from an unmonitored mailbox. You are receiving
+        this email because you are part of the PossibleWorks organization.
+        <a href="https://possibleworks.com/privacy-policy"
+          style="color: #2e5cb8 !important; text-decoration: underline !important;">Privacy Statement</a>
+      </p>
+    </div>
+  </div>
+</body>
+"""
+
+def bind_run(telemetry, run):
+    bound["telemetry"] = telemetry
+    bound["run"] = run
+
+def scan(rows):
+    if bound:
+        bound["telemetry"].scan(bound["run"], rows)
+    return rows
+
+def debug(message):
+    if bound:
+        bound["telemetry"].debug(bound["run"], message)
+
+def group_by(rows, field):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[field], []).append(row)
+    return grouped
+
+def get_employees(filters=None, fields=None):
+    filters = filters or {"status": "Active"}
+    fields = fields or ["name", "employee_name", "user_id", "company_email", "company", "default_shift"]
+    key = ("employees", json.dumps(filters, sort_keys=True, default=str), tuple(fields))
+    if key not in memo:
+        memo[key] = scan(frappe.get_all("Employee", filters=filters, fields=fields))
+    return memo[key]
+
+def get_shift_types():
+    # Shift Type is a small table: load it whole, keyed by name
+    key = ("shift_types",)
+    if key not in memo:
+        rows = scan(frappe.get_all(
+            "Shift Type",
+            fields=["name", "start_time", "end_time", "late_entry_grace_period"],
+        ))
+        memo[key] = {row.name: row for row in rows}
+    return memo[key]
+
+def get_shift_names(employee_ids, on_date):
+    # employee -> shift name on on_date: latest active Shift Assignment, else default_shift
+    key = ("shift_names", tuple(employee_ids), str(on_date))
+    if key in memo:
+        return memo[key]
+    shift_names = {}
+    if employee_ids:
+        defaults = scan(frappe.get_all(
+            "Employee",
+            filters={"name": ["in", employee_ids], "default_shift": ["is", "set"]},
+            fields=["name", "default_shift"],
+        ))
+        for row in defaults:
+            shift_names[row.name] = row.default_shift
+        assignments = scan(frappe.db.sql(
+            """
+            SELECT sa.employee, sa.shift_type AS shift
+            FROM `tabShift Assignment` sa
+            WHERE sa.employee IN %s
+              AND sa.docstatus = 1
+              AND sa.start_date <= %s
+              AND (sa.end_date IS NULL OR sa.end_date >= %s)
+            ORDER BY sa.start_date ASC
+            """,
+            (employee_ids, on_date, on_date),
+            as_dict=1,
+        ))
+        # Ascending order: the latest assignment overwrites earlier ones
+        for row in assignments:
+            if row.shift:
+                shift_names[row.employee] = row.shift
+    memo[key] = shift_names
+    return shift_names
+
+def get_employee_shift_types(employee_ids, on_date):
+    # employee -> Shift Type row (name, start_time, late_entry_grace_period, ...)
+    shift_types = get_shift_types()
+    shift_names = get_shift_names(employee_ids, on_date)
+    return {emp: shift_types[name] for emp, name in shift_names.items() if name in shift_types}
+
+def get_checkins(employee_ids, from_date, to_date, log_type="IN"):
+    # employee -> check-ins between from_date and the end of to_date, in time order
+    key = ("checkins", tuple(employee_ids), str(from_date), str(to_date), log_type)
+    if key in memo:
+        return memo[key]
+    rows = []
+    if employee_ids:
+        rows = scan(frappe.get_all(
+            "Employee Checkin",
+            filters={
+                "employee": ["in", employee_ids],
+                "time": ["between", [from_date, frappe.utils.add_days(to_date, 1)]],
+                "log_type": log_type,
+            },
+            fields=["name", "employee", "time"],
+            order_by="employee asc, time asc",
+        ))
+    memo[key] = group_by(rows, "employee")
+    return memo[key]
+
+def get_allowed_time(shift_start, late_grace_minutes):
+    # "HH:MM" of the last minute a first check-in is still on time
+    if late_grace_minutes is None:
+        late_grace_minutes = DEFAULT_GRACE_MINUTES
+    shift_hms = str(shift_start).split(":")
+    allowed_minute = int(shift_hms[1]) + late_grace_minutes
+    allowed_hour = int(shift_hms[0]) + allowed_minute // 60
+    return f"{allowed_hour:02d}:{allowed_minute % 60:02d}"
+
+def get_late_days(checkins, shift_start, late_grace_minutes):
+    # "YYYY-MM-DD" -> {"is_late", "first_in"} from one employee's IN check-ins
+    allowed_time = get_allowed_time(shift_start, late_grace_minutes)
+    late_days = {}
+    for ch in checkins:
+        ch_time = str(ch["time"])
+        day = ch_time[:10]
+        if day in late_days and late_days[day]["first_in"] <= ch_time:
+            continue
+        late_days[day] = {
+            "is_late": ch_time[11:16] > allowed_time,
+            "first_in": ch_time,
+        }
+    for day in sorted(late_days):
+        debug(f"Day: {day}, First In: {late_days[day]['first_in'][11:16]}, Allowed: {allowed_time}, Late: {late_days[day]['is_late']}")
+    return late_days
+
+def number_late_days(late_days, until_date, shift_doc):
+    # Late days of get_late_days() up to until_date, numbered 1, 2, 3, ... in date
+    # order; same rows as get_numbered_late_days() for a window inside one month
+    numbered = []
+    for day in sorted(late_days):
+        if late_days[day]["is_late"] and day <= str(until_date):
+            numbered.append({
+                "attendance_date": day,
+                "first_in": late_days[day]["first_in"],
+                "late_number": len(numbered) + 1,
+                "shift": shift_doc.name,
+                "shift_start": shift_doc.start_time,
+            })
+    return numbered
+
+def get_numbered_late_days(employee_ids, from_date, to_date, min_late_number=1, on_day=None):
+    # employee -> late days numbered per employee and month, computed in the database:
+    # first IN per day, late against the employee's shift (latest Shift Assignment on
+    # to_date, else default_shift) plus grace, then ROW_NUMBER() over the late days.
+    # Only rows with late_number >= min_late_number (and on on_day, if given) return.
+    key = ("numbered_late_days", tuple(employee_ids), str(from_date), str(to_date), min_late_number, str(on_day))
+    if key in memo:
+        return memo[key]
+    rows = []
+    if employee_ids:
+        day_filter = "AND attendance_date = %s" if on_day else ""
+        values = [employee_ids, str(from_date), str(frappe.utils.add_days(to_date, 1)),
+                  str(to_date), str(to_date), employee_ids, min_late_number]
+        if on_day:
+            values.append(str(on_day))
+        rows = scan(frappe.db.sql(
+            f"""
+            WITH first_in AS (
+                SELECT ec.employee, DATE(ec.time) AS attendance_date, MIN(ec.time) AS first_in
+                FROM `tabEmployee Checkin` ec
+                WHERE ec.employee IN %s
+                  AND ec.log_type = 'IN'
+                  AND ec.time >= %s
+                  AND ec.time < %s
+                GROUP BY ec.employee, DATE(ec.time)
+            ),
+            employee_shift AS (
+                SELECT e.name AS employee, st.name AS shift, st.start_time,
+                       COALESCE(st.late_entry_grace_period, 10) AS grace_minutes
+                FROM `tabEmployee` e
+                JOIN `tabShift Type` st ON st.name = COALESCE(
+                    (
+                        SELECT sa.shift_type
+                        FROM `tabShift Assignment` sa
+                        WHERE sa.employee = e.name
+                          AND sa.docstatus = 1
+                          AND sa.start_date <= %s
+                          AND (sa.end_date IS NULL OR sa.end_date >= %s)
+                          AND sa.shift_type IS NOT NULL AND sa.shift_type != ''
+                        ORDER BY sa.start_date DESC
+                        LIMIT 1
+                    ),
+                    e.default_shift
+                )
+                WHERE e.name IN %s
+            ),
+            late_day AS (
+                SELECT f.employee, f.attendance_date, f.first_in, s.shift, s.start_time AS shift_start,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY f.employee, SUBSTR(f.attendance_date, 1, 7)
+                           ORDER BY f.attendance_date
+                       ) AS late_number
+                FROM first_in f
+                JOIN employee_shift s ON s.employee = f.employee
+                WHERE TIME_TO_SEC(TIME(f.first_in)) DIV 60 > TIME_TO_SEC(s.start_time) DIV 60 + s.grace_minutes
+            )
+            SELECT employee, attendance_date, first_in, shift, shift_start, late_number
+            FROM late_day
+            WHERE late_number >= %s {day_filter}
+            ORDER BY employee, attendance_date
+            """,
+            values,
+            as_dict=1,
+        ))
+    for row in rows:
+        row["attendance_date"] = str(row["attendance_date"])
+        row["first_in"] = str(row["first_in"])
+    memo[key] = group_by(rows, "employee")
+    return memo[key]
+
+def get_attendance(employee_ids, from_date, to_date, filters=None, fields=None):
+    # Attendance rows of the window, ordered by employee and date
+    fields = fields or ["name", "employee", "attendance_date", "status", "docstatus", "working_hours"]
+    key = ("attendance", tuple(employee_ids), str(from_date), str(to_date),
+           json.dumps(filters or {}, sort_keys=True, default=str), tuple(fields))
+    if key in memo:
+        return memo[key]
+    rows = []
+    if employee_ids:
+        window = {
+            "employee": ["in", employee_ids],
+            "attendance_date": ["between", [str(from_date), str(to_date)]],
+        }
+        window.update(filters or {"docstatus": ["!=", 2]})
+        rows = scan(frappe.get_all(
+            "Attendance",
+            filters=window,
+            fields=fields,
+            order_by="employee asc, attendance_date asc",
+        ))
+    memo[key] = rows
+    return rows
+
+def get_leave_allocations(employee_ids, leave_type, from_date, to_date):
+    # employee -> allocations overlapping the window, by from_date. Every docstatus
+    # is returned; callers filter (e.g. only submitted ones count as allocated)
+    key = ("allocations", tuple(employee_ids), leave_type, str(from_date), str(to_date))
+    if key in memo:
+        return memo[key]
+    rows = []
+    if employee_ids:
+        rows = scan(frappe.get_all(
+            "Leave Allocation",
+            filters={
+                "employee": ["in", employee_ids],
+                "leave_type": leave_type,
+                "from_date": ["<=", to_date],
+                "to_date": [">=", from_date],
+            },
+            fields=["name", "employee", "from_date", "to_date", "total_leaves_allocated", "docstatus"],
+            order_by="employee asc, from_date asc",
+        ))
+    memo[key] = group_by(rows, "employee")
+    return memo[key]
+
+def get_leave_applications(employee_ids, leave_type, from_date, to_date, status="Approved"):
+    # employee -> submitted applications starting inside the window
+    key = ("applications", tuple(employee_ids), leave_type, str(from_date), str(to_date), status)
+    if key in memo:
+        return memo[key]
+    rows = []
+    if employee_ids:
+        rows = scan(frappe.get_all(
+            "Leave Application",
+            filters={
+                "employee": ["in", employee_ids],
+                "leave_type": leave_type,
+                "docstatus": 1,
+                "status": status,
+                "from_date": ["between", [str(from_date), str(to_date)]],
+            },
+            fields=["name", "employee", "from_date", "to_date", "total_leave_days"],
+            order_by="employee asc, from_date asc",
+        ))
+    memo[key] = group_by(rows, "employee")
+    return memo[key]
+
+def get_holidays(holiday_lists, from_date, to_date):
+    # holiday list -> set of "YYYY-MM-DD" inside the window
+    key = ("holidays", tuple(holiday_lists), str(from_date), str(to_date))
+    if key in memo:
+        return memo[key]
+    holidays = {}
+    if holiday_lists:
+        rows = scan(frappe.get_all(
+            "Holiday",
+            filters={
+                "parent": ["in", holiday_lists],
+                "holiday_date": ["between", [str(from_date), str(to_date)]],
+            },
+            fields=["parent", "holiday_date"],
+        ))
+        for row in rows:
+            holidays.setdefault(row.parent, set()).add(str(row.holiday_date))
+    memo[key] = holidays
+    return holidays
+
+def add_status_version(att_name, old_status, new_status):
+    # Same timeline entry a regular save would leave, without loading the document
+    frappe.get_doc({
+        "doctype": "Version",
+        "ref_doctype": "Attendance",
+        "docname": att_name,
+        "data": json.dumps({
+            "added": [],
+            "changed": [["status", old_status, new_status]],
+            "removed": [],
+            "row_changed": [],
+        }),
+    }).insert(ignore_permissions=True)
+
+def add_comment(reference_doctype, reference_name, comment_text):
+    frappe.get_doc({
+        "doctype": "Comment",
+        "comment_type": "Comment",
+        "reference_doctype": reference_doctype,
+        "reference_name": reference_name,
+        "comment_email": frappe.session.user,
+        "content": comment_text,
+    }).insert(ignore_permissions=True)
+
+def claim_notice(employee_id, notice_date, notice_type):
+    # Insert first, act second: a duplicate key means another run already
+    # recorded this notice. Returns the ledger row name, or None
+    try:
+        return frappe.get_doc({
+            "doctype": NOTICE_LEDGER,
+            "employee": employee_id,
+            "notice_date": str(notice_date),
+            "notice_type": notice_type,
+        }).insert(ignore_permissions=True).name
+    except Exception as e:
+        debug(f"SKIPPED: {notice_type} for {employee_id} on {notice_date} already recorded - {str(e)}")
+        return None
+
+def get_noticed_days(notice_type, from_date, to_date):
+    # {(employee, "YYYY-MM-DD")} already in the ledger for notice_type in the window
+    rows = scan(frappe.get_all(
+        NOTICE_LEDGER,
+        filters={"notice_type": notice_type, "notice_date": ["between", [str(from_date), str(to_date)]]},
+        fields=["employee", "notice_date"],
+    ))
+    return {(row.employee, str(row.notice_date)) for row in rows}
+
+def get_sender_email():
+    key = ("sender_email",)
+    if key not in memo:
+        memo[key] = frappe.db.get_single_value("HR Settings", "sender_email") \
+            or frappe.db.get_single_value("Email Account", "default_sender") or "no-reply@example.com"
+    return memo[key]
+
+def get_late_entry_email_template():
+    # [subject, body] of the late entry Email Template, read once per run
+    key = ("late_entry_email_template",)
+    if key in memo:
+        return memo[key]
+    template = frappe.db.get_value(
+        "Email Template",
+        LATE_ENTRY_EMAIL_TEMPLATE,
+        ["subject", "use_html", "response_html", "response"],
+        as_dict=True,
+    )
+    scan([template] if template else [])
+    if not template:
+        debug(f"Email Template '{LATE_ENTRY_EMAIL_TEMPLATE}' not found, using built-in template")
+        memo[key] = [DEFAULT_LATE_ENTRY_SUBJECT, DEFAULT_LATE_ENTRY_TEMPLATE]
+    else:
+        body = template.response_html if template.use_html else template.response
+        memo[key] = [template.subject or DEFAULT_LATE_ENTRY_SUBJECT, body or DEFAULT_LATE_ENTRY_TEMPLATE]
+    return memo[key]
+
+def get_late_entry_email_context(employee_name, attendance_date, shift_start, first_in, current_late_number):
+    return {
+        "emp_first_name": (employee_name.split(" ")[0]).capitalize() if employee_name else "there",
+        "employee_name": employee_name,
+        "attendance_date": attendance_date,
+        "shift_start": str(shift_start)[:5],
+        "first_in": str(first_in)[11:16],
+        "late_number": current_late_number,
+        "is_fourth_late": 1 if current_late_number == 4 else 0,
+    }
+
+def render_late_entry_email(context):
+    # [subject, message] of one notice
+    subject_template, body_template = get_late_entry_email_template()
+    return [
+        frappe.render_template(subject_template, context).strip(),
+        frappe.render_template(body_template, context),
+    ]
+
+frappe.flags.bind_run = bind_run
+frappe.flags.group_by = group_by
+frappe.flags.get_employees = get_employees
+frappe.flags.get_shift_types = get_shift_types
+frappe.flags.get_shift_names = get_shift_names
+frappe.flags.get_employee_shift_types = get_employee_shift_types
+frappe.flags.get_checkins = get_checkins
+frappe.flags.get_late_days = get_late_days
+frappe.flags.number_late_days = number_late_days
+frappe.flags.get_numbered_late_days = get_numbered_late_days
+frappe.flags.get_attendance = get_attendance
+frappe.flags.get_leave_allocations = get_leave_allocations
+frappe.flags.get_leave_applications = get_leave_applications
+frappe.flags.get_holidays = get_holidays
+frappe.flags.get_allowed_time = get_allowed_time
+frappe.flags.add_status_version = add_status_version
+frappe.flags.add_comment = add_comment
+frappe.flags.claim_notice = claim_notice
+frappe.flags.get_noticed_days = get_noticed_days
+frappe.flags.get_sender_email = get_sender_email
+frappe.flags.get_late_entry_email_template = get_late_entry_email_template
+frappe.flags.get_late_entry_email_context = get_late_entry_email_context
+frappe.flags.render_late_entry_email = render_late_entry_email
@@ -0,0 +1,87 @@
+# Server Script: HR Job Coordinator
+# Script Type: API
+# API Method: hr_job_coordinator
+# NOTE: Do NOT use import statements in Server Scripts - modules are pre-loaded
+#
+# Keeps the scheduled HR jobs of one site from running on top of each other.
+# Each job calls, before doing any work,
+#     coordinator = run_script("HR Job Coordinator")
+#     if coordinator.claim(telemetry, run):
+#         execute()
+# and claim():
+#   1. skips the run when the previous run of the same job still holds its lock,
+#   2. waits (up to MAX_QUEUE_WAIT) for any other HR job of the site to finish,
+#   3. waits (same budget) while a `bench backup` dump is reading this site.
+# Locks are MariaDB named locks (GET_LOCK), prefixed with the site database so
+# tenants on a shared MariaDB do not block each other. They belong to the
+# worker's connection: a job killed mid-run releases them when it disconnects.
+# telemetry.finish_run() commits the run and releases them.
+
+# Seconds a job may wait for the site. Scheduled Server Scripts run on the
+# default queue (300s job timeout), so the wait must leave room for the job.
+MAX_QUEUE_WAIT = 120
+BACKUP_POLL_SECONDS = 10
+SITE_LOCK = "hr-jobs"
+
+def get_lock(name, timeout):
+    acquired = frappe.db.sql(
+        "SELECT GET_LOCK(CONCAT(DATABASE(), ':', %s), %s)", (name, timeout)
+    )
+    return bool(acquired and acquired[0][0] == 1)
+
+def release_lock(name):
+    frappe.db.sql("SELECT RELEASE_LOCK(CONCAT(DATABASE(), ':', %s))", (name,))
+
+def job_lock(run):
+    return "hr-job:" + run["script"]
+
+def backup_running():
+    # mysqldump / mariadb-dump read every table with SELECT /*!40001 SQL_NO_CACHE */
+    rows = frappe.db.sql(
+        """
+        SELECT COUNT(*)
+        FROM information_schema.PROCESSLIST
+        WHERE DB = DATABASE()
+          AND ID != CONNECTION_ID()
+          AND INFO LIKE %s
+        """,
+        ("%SQL_NO_CACHE%",),
+    )
+    return bool(rows and rows[0][0])
+
+def waited_since(started):
+    return frappe.utils.time_diff_in_seconds(frappe.utils.now_datetime(), started)
+
+def skip(telemetry, run, reason):
+    run["skip_reason"] = reason
+    telemetry.finish_run(run, "Skipped")
+    return False
+
+def release(run):
+    frappe.db.commit()
+    release_lock(SITE_LOCK)
+    release_lock(job_lock(run))
+
+def claim(telemetry, run, max_wait=MAX_QUEUE_WAIT):
+    if not get_lock(job_lock(run), 0):
+        return skip(telemetry, run, "Previous run still in progress")
+
+    queued_at = frappe.utils.now_datetime()
+    if not get_lock(SITE_LOCK, max_wait):
+        release_lock(job_lock(run))
+        run["queue_wait"] = round(waited_since(queued_at), 3)
+        return skip(telemetry, run, f"Another HR job held the site for over {max_wait}s")
+
+    while backup_running():
+        if waited_since(queued_at) >= max_wait:
+            # Run anyway: the dump does not lock rows, it only competes for I/O
+            telemetry.debug(run, "Backup still running after the queue budget; starting anyway")
+            break
+        frappe.db.sql("SELECT SLEEP(%s)", (BACKUP_POLL_SECONDS,))
+
+    run["queue_wait"] = round(waited_since(queued_at), 3)
+    run["on_finish"].append(release)
+    return True
+
+frappe.flags.claim = claim
+frappe.flags.release = release
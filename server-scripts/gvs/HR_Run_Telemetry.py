@@ -0,0 +1,108 @@
+# Server Script: HR Run Telemetry
+# Script Type: API
+# API Method: hr_run_telemetry
+# NOTE: Do NOT use import statements in Server Scripts - modules are pre-loaded
+#
+# Shared run telemetry for the GVS scheduled scripts. Load it with
+#     telemetry = run_script("HR Run Telemetry")
+# run_script returns this script's frappe.flags, which is where the helpers are
+# published. Each run ends up as one "HR Script Run" record with phase
+# durations and counters (see server-scripts/setup/hr-script-run.md).
+
+DEBUG_LOG_LIMIT = 500
+
+def start_run(script_name, debug_sample_every=0):
+    return {
+        "script": script_name,
+        "started_at": frappe.utils.now_datetime(),
+        "queue_wait": 0,
+        "skip_reason": "",
+        "phases": {},
+        "phase": None,
+        "phase_started": None,
+        "queries": 0,
+        "rows_scanned": 0,
+        "writes": 0,
+        "emails": 0,
+        "errors": 0,
+        "debug_sample_every": debug_sample_every or 0,
+        "debug_calls": 0,
+        "debug_log": [],
+        # Called with the run once it is recorded (HR Job Coordinator releases its locks here)
+        "on_finish": [],
+    }
+
+def start_phase(run, phase):
+    end_phase(run)
+    run["phase"] = phase
+    run["phase_started"] = frappe.utils.now_datetime()
+
+def end_phase(run):
+    if not run["phase"]:
+        return
+    elapsed = frappe.utils.time_diff_in_seconds(frappe.utils.now_datetime(), run["phase_started"])
+    run["phases"][run["phase"]] = round(run["phases"].get(run["phase"], 0) + elapsed, 3)
+    run["phase"] = None
+
+def scan(run, rows):
+    # Wrap a read: counts one query and the rows it returned
+    run["queries"] = run["queries"] + 1
+    run["rows_scanned"] = run["rows_scanned"] + len(rows or [])
+    return rows
+
+def count(run, key, n=1):
+    run[key] = run[key] + n
+
+def debug(run, message):
+    # Off unless debug_sample_every is set; then every N-th line is printed and kept
+    every = run["debug_sample_every"]
+    if not every:
+        return
+    run["debug_calls"] = run["debug_calls"] + 1
+    if run["debug_calls"] % every:
+        return
+    print(message)
+    if len(run["debug_log"]) < DEBUG_LOG_LIMIT:
+        run["debug_log"].append(str(message))
+
+def finish_run(run, status="Success"):
+    end_phase(run)
+    finished_at = frappe.utils.now_datetime()
+    # Run time only: time spent queued behind other HR jobs is kept in queue_wait
+    duration = frappe.utils.time_diff_in_seconds(finished_at, run["started_at"]) - run["queue_wait"]
+    try:
+        frappe.get_doc({
+            "doctype": "HR Script Run",
+            "script": run["script"],
+            "status": status,
+            "started_at": run["started_at"],
+            "finished_at": finished_at,
+            "duration": duration,
+            "queue_wait": run["queue_wait"],
+            "skip_reason": run["skip_reason"],
+            "queries": run["queries"],
+            "rows_scanned": run["rows_scanned"],
+            "writes": run["writes"],
+            "emails": run["emails"],
+            "errors": run["errors"],
+            "phase_durations": json.dumps(run["phases"]),
+            "debug_log": "\n".join(run["debug_log"]),
+        }).insert(ignore_permissions=True)
+    except Exception as e:
+        frappe.log_error(title=f"HR Script Run Record Error: {run['script']}", message=str(e))
+    print(
+        f"{run['script']}: {status} in {duration:.2f}s (queued {run['queue_wait']:.2f}s) | queries: {run['queries']}, "
+        f"rows: {run['rows_scanned']}, writes: {run['writes']}, emails: {run['emails']}, "
+        f"errors: {run['errors']} | phases: {json.dumps(run['phases'])}"
+        + (f" | skipped: {run['skip_reason']}" if run["skip_reason"] else "")
+    )
+    for hook in run["on_finish"]:
+        hook(run)
+
+frappe.flags.start_run = start_run
+frappe.flags.start_phase = start_phase
+frappe.flags.end_phase = end_phase
+frappe.flags.scan = scan
+frappe.flags.count = count
+frappe.flags.debug = debug
+frappe.flags.finish_run = finish_run
@@ -0,0 +1,53 @@
+# Server Script: Real-time Late Entry Detection
+# Script Type: DocType Event
+# Reference Document Type: Employee Checkin
+# DocType Event: After Insert
+# NOTE: Do NOT use import statements in Server Scripts - modules are pre-loaded
+# NOTE: DocType Event scripts run with `doc` in a separate scope, so this script
+#       is written as straight-line code (helper functions could not see each other)
+#
+# Classifies the first IN of the day against the employee's shift and, when
+# late, enqueues the follow-up (late email, and attendance correction from the
+# 4th late onwards) on the short queue. The job numbers the late day from the
+# month's check-ins in date order, so devices syncing late or out of order
+# don't change which day is the 4th. Nothing is written here, so a check-in
+# insert never fails because of this hook.
+# See server-scripts/setup/late-entry-realtime.md
+
+REALTIME_LATE_ENTRY_ENABLED = True
+ACTION_METHOD = "late_entry_realtime_action"
+
+if REALTIME_LATE_ENTRY_ENABLED and doc.log_type == "IN":
+    checkin_str = str(doc.time)
+    day = checkin_str[:10]
+
+    # Only the first IN of the day decides lateness
+    earlier_in = frappe.db.exists(
+        "Employee Checkin",
+        {
+            "employee": doc.employee,
+            "log_type": "IN",
+            "time": ["between", [day, checkin_str]],
+            "name": ["!=", doc.name],
+        },
+    )
+
+    shift_name = doc.shift or frappe.db.get_value("Employee", doc.employee, "default_shift")
+    shift_doc = frappe.get_cached_doc("Shift Type", shift_name) if shift_name else None
+
+    if not earlier_in and shift_doc and shift_doc.start_time:
+        # Same allowed time as the nightly jobs (HR Data Access get_allowed_time)
+        hr = run_script("HR Data Access")
+        allowed_time = hr.get_allowed_time(shift_doc.start_time, shift_doc.late_entry_grace_period)
+        is_late = checkin_str[11:16] > allowed_time
+
+        if is_late:
+            frappe.enqueue(
+                ACTION_METHOD,
+                queue="short",
+                enqueue_after_commit=True,
+                job_id=f"late-entry-{doc.employee}-{day}",
+                deduplicate=True,
+                employee=doc.employee,
+                attendance_date=day,
+            )
@@ -1,270 +1,184 @@
+# True: find today's late entry and its number of the month in one MariaDB query
+# (window functions), returning one row per employee late today. False: load
+# every check-in of the month and number the late days here.
+LATE_NUMBERING_IN_DB = True
+
+# One row per (employee, date, notice type); its name is the unique key, so a
+# rerun, an overlapping cron firing or the real-time action (when enabled)
+# cannot email the same late day twice
+NOTICE_LEDGER = "HR Notice Ledger"
+NOTICE_TYPE = "Late Entry Email"
+
+# The notice is rendered by HR Data Access from the "Late Entry Notice" Email
+# Template (built-in default until it exists), see setup/late-entry-email-template.md
+# Queued mails get staggered send_after times so the queue drains at this rate
+EMAILS_PER_MINUTE = 120
+# Print (and keep on the HR Script Run record) every N-th debug line; 0 = off
+DEBUG_SAMPLE_EVERY = 0
+
+telemetry = run_script("HR Run Telemetry")
+run = telemetry.start_run("Late_Entry_Email_Triggers", DEBUG_SAMPLE_EVERY)
+hr = run_script("HR Data Access")
+hr.bind_run(telemetry, run)
+coordinator = run_script("HR Job Coordinator")
+
 def execute():
-    print("=" * 70)
-    print("STARTING LATE ENTRY EMAIL/CHECK (EMAIL ONLY, Custom Template)")
-    print("=" * 70)
+    telemetry.start_phase(run, "load")
     today = frappe.utils.getdate('2025-11-27')
     month_start = today.replace(day=1)
 
-    print(f"Period: {month_start} to {today}")
-    employees = frappe.get_all(
-        "Employee",
-        filters={"status": "Active"},
-        fields=["name", "employee_name", "user_id", "company_email"]
-    )
-    print(f"Found {len(employees)} employees for late entry check")
-    emails_sent = 0
+    print(f"Late entry email: {month_start} to {today}")
+    employees = hr.get_employees()
+    telemetry.debug(run, f"Found {len(employees)} employees for late entry check")
+    notified = get_notified_employees(today)
+    if notified:
+        employees = [emp for emp in employees if emp.name not in notified]
+        telemetry.debug(run, f"Already notified for {today}: {len(notified)}, remaining: {len(employees)}")
+    employee_ids = [emp.name for emp in employees]
+    if LATE_NUMBERING_IN_DB:
+        late_today = hr.get_numbered_late_days(employee_ids, month_start, today, on_day=today)
+    else:
+        shift_types = hr.get_employee_shift_types(employee_ids, today)
+        checkins_by_employee = hr.get_checkins(employee_ids, month_start, today)
+    pending_emails = []
     skipped = 0
 
+    telemetry.start_phase(run, "compute")
     for emp in employees:
-        print("-" * 70)
-        print(f"Processing: {emp.get('employee_name')} ({emp.get('name')})")
+        telemetry.debug(run, f"Processing: {emp.get('employee_name')} ({emp.get('name')})")
         try:
-            status = process_employee_late_entry_email_only(emp, month_start, today)
+            if LATE_NUMBERING_IN_DB:
+                late = (late_today.get(emp.name) or [None])[0]
+            else:
+                late = get_late_entry_today(
+                    emp, shift_types.get(emp.name), checkins_by_employee.get(emp.name, []), today
+                )
+            status = process_employee_late_entry_email_only(emp, late, pending_emails)
             if status == "late_email":
-                emails_sent += 1
-                print("SUCCESS: Email sent for Late Entry")
+                telemetry.debug(run, "QUEUED: Late Entry email")
             else:
-                print("SKIPPED: No action needed")
+                telemetry.debug(run, "SKIPPED: No action needed")
                 skipped += 1
         except Exception as e:
             skipped += 1
+            telemetry.count(run, "errors")
             frappe.log_error(
                 title=f"Late Entry Email Exception for Employee {emp.get('name')}",
                 message=str(e)
             )
-            print(f"FAILED: {emp.get('employee_name')} ({emp.get('name')}) - {str(e)}")
+            telemetry.debug(run, f"FAILED: {emp.get('employee_name')} ({emp.get('name')}) - {str(e)}")
 
-    print("=" * 70)
-    print("LATE ENTRY EMAIL NOTIFICATION COMPLETED")
-    print("=" * 70)
+    telemetry.start_phase(run, "send")
+    emails_sent = deliver_late_entry_emails(pending_emails)
     print(f"Sent emails: {emails_sent}, Skipped: {skipped}")
+    telemetry.finish_run(run)
+
+def get_notified_employees(notice_date):
+    return set(telemetry.scan(run, frappe.get_all(
+        NOTICE_LEDGER,
+        filters={"notice_type": NOTICE_TYPE, "notice_date": str(notice_date)},
+        pluck="employee",
+    )))
 
-def process_employee_late_entry_email_only(emp, month_start, today):
+def get_late_entry_today(emp, shift_doc, checkins, today):
+    # Python numbering (LATE_NUMBERING_IN_DB = False): today's numbered late day, or None
+    if not shift_doc or not shift_doc.start_time:
+        telemetry.debug(run, f"SKIPPED: No shift/start time for {emp.employee_name or emp.name} ({emp.name})")
+        return None
+    late_grace_minutes = shift_doc.late_entry_grace_period
+    telemetry.debug(run, f"Shift Start: {shift_doc.start_time}, Grace Period: {late_grace_minutes} mins")
+    telemetry.debug(run, f"Total check-ins found: {len(checkins)}")
+    late_days = hr.get_late_days(checkins, shift_doc.start_time, late_grace_minutes)
+    this_month_lates = hr.number_late_days(late_days, today, shift_doc)
+    telemetry.debug(run, f"Total late days so far: {len(this_month_lates)}")
+    for late in this_month_lates:
+        if late["attendance_date"] == str(today):
+            return late
+    return None
+
+def process_employee_late_entry_email_only(emp, late, pending_emails):
+    # late: today's numbered late day for this employee (None when on time)
     employee_id = emp.name
     employee_name = emp.employee_name or employee_id
     employee_email = emp.user_id or emp.company_email
     if not employee_email:
-        print(f"SKIPPED: Missing email for {employee_name} ({employee_id})")
+        telemetry.debug(run, f"SKIPPED: Missing email for {employee_name} ({employee_id})")
         frappe.log_error(
             title=f"Missing Employee Email: {employee_id}",
             message=f"No user_id or company_email found for this employee: {employee_name} ({employee_id})"
         )
         return "skipped"
 
-    shift_doc = get_employee_shift(employee_id, today)
-    if not shift_doc or not shift_doc.start_time:
-        print(f"SKIPPED: No shift/start time for {employee_name} ({employee_id})")
-        return "skipped"
-
-    try:
-        late_grace_minutes = shift_doc.late_entry_grace_period
-    except Exception:
-        late_grace_minutes = 10
-
-    shift_start = shift_doc.start_time
-    print(f"Shift Start: {shift_start}, Grace Period: {late_grace_minutes} mins")
-
-    checkins = get_employee_checkins_for_month(employee_id, month_start, today)
-    print(f"Total check-ins found: {len(checkins)}")
-    if checkins:
-        print("All check-in times:")
-        for ch in checkins:
-            print(f"   - {str(ch['time'])}")
-
-    late_days = get_late_days_from_checkins(checkins, shift_start, late_grace_minutes)
-    sorted_dates = sorted([d for d in late_days.keys() if d <= str(today)])
-    this_month_lates = [d for d in sorted_dates if late_days[d]["is_late"]]
-    total_lates = len(this_month_lates)
-    print(f"Total late days so far: {total_lates}")
-
-    today_str = str(today)
-    if today_str not in late_days or not late_days[today_str]["is_late"]:
-        print(f"No late entry for {employee_name} today.")
+    if not late:
+        telemetry.debug(run, f"No late entry for {employee_name} today.")
         return "skipped"
 
-    this_late_number = this_month_lates.index(today_str) + 1
-
-    send_late_entry_email_with_template(
-        employee_id=employee_id,
-        employee_name=employee_name,
-        employee_email=employee_email,
-        attendance_date=today_str,
-        shift_start=shift_start,
-        first_in=late_days[today_str]["first_in"],
-        current_late_number=this_late_number,
-    )
-    print(f"Email sent: {employee_name} ({employee_id}) - Late #{this_late_number}")
+    this_late_number = late["late_number"]
+
+    pending_emails.append({
+        "employee_id": employee_id,
+        "employee_email": employee_email,
+        "context": hr.get_late_entry_email_context(
+            employee_name=employee_name,
+            attendance_date=late["attendance_date"],
+            shift_start=late["shift_start"],
+            first_in=late["first_in"],
+            current_late_number=this_late_number,
+        ),
+    })
+    telemetry.debug(run, f"Email queued: {employee_name} ({employee_id}) - Late #{this_late_number}")
     return "late_email"
 
-def get_employee_shift(employee_id, on_date):
-    try:
-        shift_assignment = frappe.db.sql(
-            """
-            SELECT sa.shift_type AS shift
-            FROM `tabShift Assignment` sa
-            WHERE sa.employee = %s
-              AND sa.docstatus = 1
-              AND sa.start_date <= %s
-              AND (sa.end_date IS NULL OR sa.end_date >= %s)
-            ORDER BY sa.start_date DESC
-            LIMIT 1
-            """,
-            (employee_id, on_date, on_date),
-            as_dict=1,
-        )
-        shift_name = None
-        if shift_assignment:
-            shift_name = shift_assignment[0].get("shift")
-        if not shift_name:
-            shift_name = frappe.db.get_value("Employee", employee_id, "default_shift")
-        if not shift_name:
-            return None
-        return frappe.get_doc("Shift Type", shift_name)
-    except Exception as e:
-        frappe.log_error(
-            title=f"Shift Lookup Exception: {employee_id}",
-            message=str(e)
-        )
-        print(f"ERROR finding shift for {employee_id} - {str(e)}")
-        return None
-
-def get_employee_checkins_for_month(employee_id, month_start, today):
-    try:
-        end_bound = frappe.utils.add_days(today, 1)
-        checkins = frappe.get_all(
-            "Employee Checkin",
-            filters={
-                "employee": employee_id,
-                "time": ["between", [month_start, end_bound]],
-                "log_type": "IN",
-            },
-            fields=["name", "time"],
-            order_by="time asc",
-        )
-        return checkins
-    except Exception as e:
-        frappe.log_error(
-            title=f"Checkin Fetch Exception: {employee_id}",
-            message=str(e)
-        )
-        print(f"ERROR fetching checkins for {employee_id} - {str(e)}")
-        return []
-
-def get_late_days_from_checkins(checkins, shift_start, late_grace_minutes):
-    per_day_first_in = {}
-    for ch in checkins:
-        ch_time = str(ch["time"])
-        ch_date = ch_time[:10]
-        if ch_date not in per_day_first_in:
-            per_day_first_in[ch_date] = []
-        per_day_first_in[ch_date].append(ch_time)
-    late_days = {}
-    for day, times in per_day_first_in.items():
-        times.sort()
-        first_in = times[0]
-        print(f"Check-ins for {day}:")
-        for t in times:
-            print(f"   - {t}")
-        shift_hms = str(shift_start).split(":")
-        shift_hour = int(shift_hms[0])
-        shift_minute = int(shift_hms[1])
-        allowed_minute = shift_minute + late_grace_minutes
-        allowed_hour = shift_hour + allowed_minute // 60
-        allowed_minute = allowed_minute % 60
-        allowed_time = f"{allowed_hour:02d}:{allowed_minute:02d}"
-        first_in_time = first_in[11:16]
-        is_late = first_in_time > allowed_time
-        print(f"Day: {day}, First In: {first_in_time}, Allowed: {allowed_time}, Late: {is_late}")
-        late_days[day] = {
-            "is_late": is_late,
-            "first_in": first_in,
-        }
-    return late_days
-
-def send_late_entry_email_with_template(
-    employee_id,
-    employee_name,
-    employee_email,
-    attendance_date,
-    shift_start,
-    first_in,
-    current_late_number
-):
-    try:
-        sender_email = frappe.db.get_single_value("HR Settings", "sender_email") \
-            or frappe.db.get_single_value("Email Account", "default_sender") or "no-reply@example.com"
-        emp_first_name = (employee_name.split(" ")[0]).capitalize() if employee_name else "there"
-        attendance_date_str = attendance_date
-        shift_start_str = str(shift_start)[:5]
-        first_in_str = str(first_in)[11:16]
-        subject = f"Late Entry Notice - {attendance_date_str}"
-        half_day_note = ""
-        if current_late_number == 4:
-            half_day_note = (
-                "<p style='color:#b3261e;font-size:14px;font-weight:500;'>"
-                "Please note: This is your 4th late entry for this month. "
-                "As per policy, today has been marked for HR review."
-                "</p>"
+def deliver_late_entry_emails(pending_emails):
+    if not pending_emails:
+        return 0
+    sender_email = hr.get_sender_email()
+    print(f"Queueing {len(pending_emails)} late entry emails from {sender_email}")
+    run_start = frappe.utils.now_datetime()
+    sent = 0
+    for position, item in enumerate(pending_emails):
+        # Rendered one by one: a template error only costs this employee's notice
+        try:
+            subject, message = hr.render_late_entry_email(item["context"])
+        except Exception as e:
+            telemetry.count(run, "errors")
+            frappe.log_error(
+                title=f"Late Entry Email Render Error: {item['employee_id']}",
+                message=str(e)
             )
+            telemetry.debug(run, f"ERROR rendering late entry email for {item['employee_id']} - {str(e)}")
+            continue
+        notice = hr.claim_notice(item["employee_id"], item["context"]["attendance_date"], NOTICE_TYPE)
+        if not notice:
+            continue
+        telemetry.count(run, "writes")
+        try:
+            frappe.sendmail(
+                sender=sender_email,
+                recipients=[item["employee_email"]],
+                subject=subject,
+                message=message,
+                header="Late Entry Notice",
+                delayed=True,
+                send_after=frappe.utils.add_to_date(run_start, minutes=position // EMAILS_PER_MINUTE),
+            )
+            sent += 1
+            telemetry.count(run, "emails")
+        except Exception as e:
+            telemetry.count(run, "errors")
+            frappe.delete_doc(NOTICE_LEDGER, notice, ignore_permissions=True)
+            frappe.log_error(
+                title=f"Email Send Error: {item['employee_id']} ({item['employee_email']})",
+                message=str(e)
+            )
+    print(f"Queued {sent} late entry emails")
+    return sent
 
-        message = f"""
-<body style="font-family: Arial, sans-serif; margin: 0; padding: 0">
-  <div class="container" style="max-width: 600px; background-color: white; margin: 0 auto; border-radius: 10px;">
-    <div class="container-body" style="padding: 32px 24px; background-color: #eaf1fe; border-radius: 12px;">
-      <div class="header" style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 24px;">
-        <div class="logo">
-          <img src="https://pw-images-dev.s3.ap-south-2.amazonaws.com/PWLogoForEmailV3.png" alt="PossibleWorks Logo" style="height:40px"/>
-        </div>
-      </div>
-      <div class="content" style="color: #0f1e3d; border-radius: 12px">
-        <h2 style="font-size: 20px; font-weight: 500; color: #0f1e3d;">
-          Hey {emp_first_name},
-        </h2>
-        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
-          This is to inform you that your check-in on <strong>{attendance_date_str}</strong>
-          was recorded as a late entry.
-        </p>
-        <ul style="color: #3d475c; font-size: 14px; font-weight: 400; padding-left: 20px;">
-          <li><strong>Shift Start Time:</strong> {shift_start_str}</li>
-          <li><strong>Your First Check-in:</strong> {first_in_str}</li>
-          <li><strong>Late Entry Count (This Month):</strong> {current_late_number}</li>
-        </ul>
-        {half_day_note}
-        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
-          If you believe this is an error, please reach out to your HR team.
-        </p>
-        <p style="color: #3d475c; font-size: 14px; font-weight: 400;">
-          Best regards,<br>HR Team
-        </p>
-      </div>
-    </div>
-    <div class="footer" style="text-align: center; padding: 32px 20px; background-color: white; font-size: 12px; color: #2e5cb8; font-weight: 400;">
-      <p>This email was sent from an unmonitored mailbox. You are receiving
-        this email because you are part of the PossibleWorks organization.
-        <a href="https://possibleworks.com/privacy-policy"
-          style="color: #2e5cb8 !important; text-decoration: underline !important;">Privacy Statement</a>
-      </p>
-    </div>
-  </div>
-</body>
-        """
-        print("Sender Email:", sender_email)
-        print("Employee Email:", employee_email)
-        print("Email Body:\n", message)
-        frappe.sendmail(
-            sender=sender_email,
-            recipients=[employee_email],
-            subject=subject,
-            message=message,
-            header="Late Entry Notice",
-        )
-        print("Email successfully sent to", employee_email)
+if coordinator.claim(telemetry, run):
+    try:
+        execute()
     except Exception as e:
-        frappe.log_error(
-            title=f"Email Send Error: {employee_id} ({employee_email})",
-            message=str(e)
-        )
-        print(f"ERROR sending email for {employee_id} - {str(e)}")
-        raise
-
-execute()
+        print(f"CRITICAL ERROR: {str(e)}")
+        frappe.log_error(message=str(e), title="Late Entry Emails - Critical Error")
+        telemetry.count(run, "errors")
+        telemetry.finish_run(run, "Failed")
@@ -0,0 +1,166 @@
+# Server Script: Real-time Late Entry Action
+# Script Type: API
+# API Method: late_entry_realtime_action
+# NOTE: Do NOT use import statements in Server Scripts - modules are pre-loaded
+#
+# Enqueued on the short queue by Late_Entry_Checkin_Event.py for each late
+# first check-in. Numbers the day among the month's late days in date order
+# (HR Data Access get_numbered_late_days, same as the nightly jobs), sends the
+# late entry email and, from the 4th late of the month, marks the day Half Day
+# (or Absent when already Half Day) in place.
+# Only the enqueued job (no HTTP request) and HR users may run it.
+
+LATE_THRESHOLD = 4
+# HR Notice Ledger types, shared with Late_Entry_Email_Triggers.py and
+# Late_entry_Email_cron.py so a day is emailed and corrected once, whichever
+# job gets there first. The email itself is rendered by HR Data Access from
+# the shared "Late Entry Notice" template
+EMAIL_NOTICE_TYPE = "Late Entry Email"
+CORRECTION_NOTICE_TYPE = "Late Entry Correction"
+# Roles allowed to call /api/method/late_entry_realtime_action directly
+HR_ROLES = ["HR Manager", "HR User", "System Manager"]
+
+hr = run_script("HR Data Access")
+
+def caller_allowed():
+    # The job enqueued by Late_Entry_Checkin_Event.py runs without a request
+    if not frappe.request:
+        return True
+    if frappe.session.user == "Administrator":
+        return True
+    return bool(frappe.db.exists(
+        "Has Role",
+        {"parenttype": "User", "parent": frappe.session.user, "role": ["in", HR_ROLES]},
+    ))
+
+def execute():
+    if not caller_allowed():
+        frappe.throw("Not permitted", title="Late Entry Action")
+    args = frappe.form_dict
+    employee_id = args.get("employee")
+    attendance_date = str(args.get("attendance_date") or "")
+    if not employee_id or not attendance_date:
+        return
+
+    emp = frappe.db.get_value(
+        "Employee",
+        employee_id,
+        ["name", "employee_name", "user_id", "company_email", "company"],
+        as_dict=True,
+    )
+    if not emp:
+        return
+
+    month_start = frappe.utils.get_first_day(attendance_date)
+    late = hr.get_numbered_late_days(
+        [employee_id], month_start, attendance_date, on_day=attendance_date
+    ).get(employee_id)
+    if not late:
+        return
+    late = late[0]
+    late_number = late["late_number"]
+
+    if late_number >= LATE_THRESHOLD and hr.claim_notice(employee_id, attendance_date, CORRECTION_NOTICE_TYPE):
+        # The ledger row and the correction commit together; a failed
+        # correction rolls both back and leaves the day for the nightly job
+        try:
+            correct_attendance(emp, attendance_date, late["shift"], late_number, late["first_in"])
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(
+                title=f"Realtime Attendance Change Error: {employee_id} ({attendance_date})",
+                message=str(e)
+            )
+
+    employee_email = emp.user_id or emp.company_email
+    if not employee_email:
+        frappe.log_error(
+            title=f"Missing Employee Email: {employee_id}",
+            message=f"No user_id or company_email found for this employee: {emp.employee_name} ({employee_id})"
+        )
+        return
+
+    if not hr.claim_notice(employee_id, attendance_date, EMAIL_NOTICE_TYPE):
+        return
+
+    send_late_entry_email_with_template(
+        employee_id=employee_id,
+        employee_name=emp.employee_name or employee_id,
+        employee_email=employee_email,
+        attendance_date=attendance_date,
+        shift_start=late["shift_start"],
+        first_in=late["first_in"],
+        current_late_number=late_number,
+    )
+
+def correct_attendance(emp, attendance_date, shift_name, late_number, checkin_time):
+    att = frappe.get_all(
+        "Attendance",
+        filters={
+            "employee": emp.name,
+            "attendance_date": attendance_date,
+            "docstatus": 1
+        },
+        fields=["name", "status"]
+    )
+    old_status = att[0].status if att else None
+    if old_status == "Absent":
+        return
+    new_status = "Absent" if old_status == "Half Day" else "Half Day"
+    if att:
+        att_name = att[0].name
+        frappe.db.set_value("Attendance", att_name, {"status": new_status, "shift": shift_name})
+        hr.add_status_version(att_name, old_status, new_status)
+    else:
+        new_att = frappe.new_doc("Attendance")
+        new_att.employee = emp.name
+        new_att.employee_name = emp.employee_name
+        new_att.attendance_date = attendance_date
+        new_att.company = emp.company
+        new_att.shift = shift_name
+        new_att.status = new_status
+        new_att.flags.ignore_permissions = True
+        new_att.save()
+        new_att.submit()
+        att_name = new_att.name
+    checkin_str = str(checkin_time)[11:16] if checkin_time else "-"
+    comment_text = (
+        f"Marked {new_status} automatically on {attendance_date} due to late entry number {late_number} of month. "
+        f"First check-in: {checkin_str}."
+    )
+    hr.add_comment("Attendance", att_name, comment_text)
+    hr.add_comment("Employee", emp.name, comment_text)
+
+def send_late_entry_email_with_template(
+    employee_id,
+    employee_name,
+    employee_email,
+    attendance_date,
+    shift_start,
+    first_in,
+    current_late_number
+):
+    try:
+        subject, message = hr.render_late_entry_email(hr.get_late_entry_email_context(
+            employee_name=employee_name,
+            attendance_date=attendance_date,
+            shift_start=shift_start,
+            first_in=first_in,
+            current_late_number=current_late_number,
+        ))
+        frappe.sendmail(
+            sender=hr.get_sender_email(),
+            recipients=[employee_email],
+            subject=subject,
+            message=message,
+            header="Late Entry Notice",
+        )
+    except Exception as e:
+        frappe.log_error(
+            title=f"Email Send Error: {employee_id} ({employee_email})",
+            message=str(e)
+        )
+        raise
+
+execute()
@@ -1,226 +1,226 @@
+# Set to True once Late_Entry_Checkin_Event.py is enabled; this job then skips the
+# days the real-time action already corrected (a "Late Entry Correction" row in
+# HR Notice Ledger), records the ones it corrects itself and reconciles every
+# other late day (days the hook missed, check-ins synced late, failed or dropped jobs)
+REALTIME_LATE_ENTRY_ENABLED = False
+LATE_THRESHOLD = 4
+CORRECTION_NOTICE_TYPE = "Late Entry Correction"
+# True: number the month's late days in one MariaDB query (window functions) and
+# load only late #LATE_THRESHOLD onwards. False: load every check-in and number
+# the late days here.
+LATE_NUMBERING_IN_DB = True
+# Print (and keep on the HR Script Run record) every N-th debug line; 0 = off
+DEBUG_SAMPLE_EVERY = 0
+
+telemetry = run_script("HR Run Telemetry")
+run = telemetry.start_run("Late_entry_Email_cron", DEBUG_SAMPLE_EVERY)
+hr = run_script("HR Data Access")
+hr.bind_run(telemetry, run)
+coordinator = run_script("HR Job Coordinator")
+
 def execute():
-    print("=" * 70)
-    print("STARTING LATE ENTRY HALF DAY MASS CHECK WITH ABSENT ON 4th HALF DAY (SAFE EXEC INDEX FIX)")
-    print("=" * 70)
+    telemetry.start_phase(run, "load")
     today = frappe.utils.getdate("2025-11-28")
     month_start = today.replace(day=1)
-    print(f"Period: {month_start} to {today} (including today)")
-    employees = frappe.get_all(
-        "Employee",
-        filters={"status": "Active"},
-        fields=["name", "employee_name", "user_id", "company_email"]
-    )
-    print(f"Found {len(employees)} employees for late entry correction")
-    modified_count = 0
+    print(f"Late entry correction: {month_start} to {today} (including today)")
+    employees = hr.get_employees()
+    telemetry.debug(run, f"Found {len(employees)} employees for late entry correction")
+    corrected_days = set()
+    if REALTIME_LATE_ENTRY_ENABLED:
+        corrected_days = hr.get_noticed_days(CORRECTION_NOTICE_TYPE, month_start, today)
+        telemetry.debug(run, f"Realtime mode: {len(corrected_days)} days already corrected")
+    employee_ids = [emp.name for emp in employees]
+    attendance_map = get_attendance_map(employee_ids, month_start, today)
+    telemetry.debug(run, f"Attendance records loaded for period: {len(attendance_map)}")
+    if LATE_NUMBERING_IN_DB:
+        numbered_late_days = hr.get_numbered_late_days(employee_ids, month_start, today, LATE_THRESHOLD)
+    else:
+        shift_types = hr.get_employee_shift_types(employee_ids, today)
+        checkins_by_employee = hr.get_checkins(employee_ids, month_start, today)
+    corrections = []
     skipped = 0
 
+    telemetry.start_phase(run, "compute")
     for emp in employees:
-        print("-" * 70)
-        print(f"Processing: {emp.get('employee_name')} ({emp.get('name')})")
+        telemetry.debug(run, f"Processing: {emp.get('employee_name')} ({emp.get('name')})")
         try:
-            marked = correct_late_half_days_with_absent(emp, month_start, today)
-            modified_count += marked
-            print(f"Attendance changes for Late Entry: {marked}")
+            if LATE_NUMBERING_IN_DB:
+                late_days = numbered_late_days.get(emp.name, [])
+            else:
+                late_days = get_employee_late_days(
+                    emp, shift_types.get(emp.name), checkins_by_employee.get(emp.name, []), today
+                )
+            queued = correct_late_half_days_with_absent(
+                emp, late_days, attendance_map, corrections, corrected_days
+            )
+            telemetry.debug(run, f"Attendance changes queued for Late Entry: {queued}")
         except Exception as e:
             skipped += 1
+            telemetry.count(run, "errors")
             frappe.log_error(
                 title=f"Late Entry Processing Exception for Employee {emp.get('name')}",
                 message=str(e)
             )
-            print(f"FAILED: {emp.get('employee_name')} ({emp.get('name')}) - {str(e)}")
-    print("=" * 70)
-    print("LATE ENTRY MASS CHECK COMPLETED")
-    print("=" * 70)
-    print(f"Attendance updated: {modified_count}, Skipped: {skipped}")
+            telemetry.debug(run, f"FAILED: {emp.get('employee_name')} ({emp.get('name')}) - {str(e)}")
 
-def correct_late_half_days_with_absent(emp, month_start, until_date):
-    employee_id = emp.name
-    employee_name = emp.employee_name or employee_id
+    telemetry.start_phase(run, "write")
+    print(f"Applying {len(corrections)} attendance corrections in one batch")
+    modified_count = apply_attendance_corrections(corrections, attendance_map)
+    print(f"Attendance updated: {modified_count}, Skipped: {skipped}")
+    telemetry.finish_run(run)
 
-    shift_doc = get_employee_shift(employee_id, until_date)
+def get_employee_late_days(emp, shift_doc, checkins, until_date):
+    # Python numbering (LATE_NUMBERING_IN_DB = False): every late day of the month
     if not shift_doc or not shift_doc.start_time:
-        print(f"SKIPPED: No shift or start time for {employee_name}")
-        return 0
-
-    try:
-        late_grace_minutes = shift_doc.late_entry_grace_period
-    except Exception:
-        late_grace_minutes = 10
-
-    shift_start = shift_doc.start_time
-    print(f"Shift Start: {shift_start}, Grace Period: {late_grace_minutes} mins")
+        telemetry.debug(run, f"SKIPPED: No shift or start time for {emp.employee_name or emp.name}")
+        return []
+    late_grace_minutes = shift_doc.late_entry_grace_period
+    telemetry.debug(run, f"Shift Start: {shift_doc.start_time}, Grace Period: {late_grace_minutes} mins")
+    telemetry.debug(run, f"Total check-ins found: {len(checkins)}")
+    late_days = hr.get_late_days(checkins, shift_doc.start_time, late_grace_minutes)
+    return hr.number_late_days(late_days, until_date, shift_doc)
 
-    checkins = get_employee_checkins_for_month(employee_id, month_start, until_date)
-    print(f"Total check-ins found: {len(checkins)}")
-    late_days = get_late_days_from_checkins(checkins, shift_start, late_grace_minutes)
-    sorted_dates = sorted(late_days.keys())
-    month_late_dates = []
-    for d in sorted_dates:
-        if late_days[d]["is_late"] and d <= str(until_date):
-            month_late_dates.append(d)
+def correct_late_half_days_with_absent(emp, late_days, attendance_map, corrections, corrected_days=()):
+    # late_days: numbered late days of the month, as from hr.get_numbered_late_days;
+    # corrected_days: (employee, day) already corrected in real time
+    employee_id = emp.name
+    employee_name = emp.employee_name or employee_id
 
     changes = 0
-    i = 0
-    while i < len(month_late_dates):
-        day = month_late_dates[i]
-        late_num = i + 1
-        if late_num >= 4:  # 4th late and beyond
-            print(f"Checking {day} (Late #{late_num})...")
-            att_rec = get_attendance_record(employee_id, day)
-            att_name = att_rec[0]
+    for late in late_days:
+        day = late["attendance_date"]
+        late_num = late["late_number"]
+        if late_num < LATE_THRESHOLD:
+            continue
+        if (employee_id, day) in corrected_days:
+            telemetry.debug(run, f"-- {day} (Late #{late_num}) already handled in real time, SKIP.")
+        else:  # 4th late and beyond
+            telemetry.debug(run, f"Checking {day} (Late #{late_num})...")
+            att_rec = get_attendance_record(attendance_map, employee_id, day)
             att_status = att_rec[1]
-            try:
-                if att_status == "Absent":
-                    print(f"-- Already Absent on {day}, SKIP.")
-                    i += 1
-                    continue
-                elif att_status == "Half Day":
-                    change_attendance_status(employee_id, employee_name, day, shift_doc.name, "Absent", late_num, late_days[day]["first_in"])
-                    print(f"-- Marked Absent (was Half Day) on {day}")
-                    changes += 1
-                else:
-                    change_attendance_status(employee_id, employee_name, day, shift_doc.name, "Half Day", late_num, late_days[day]["first_in"])
-                    print(f"-- Marked Half Day on {day}")
-                    changes += 1
-            except Exception as e:
-                frappe.log_error(
-                    title=f"Attendance Change Error: {employee_id} ({day})",
-                    message=str(e)
-                )
-                print(f"ERROR changing attendance for {employee_name} on {day} - {str(e)}")
-        i += 1
+            if att_status == "Absent":
+                telemetry.debug(run, f"-- Already Absent on {day}, SKIP.")
+                continue
+            new_status = "Absent" if att_status == "Half Day" else "Half Day"
+            corrections.append({
+                "employee": employee_id,
+                "employee_name": employee_name,
+                "company": emp.company,
+                "attendance_date": day,
+                "shift": late["shift"],
+                "new_status": new_status,
+                "late_number": late_num,
+                "checkin_time": late["first_in"],
+            })
+            telemetry.debug(run, f"-- Queued {new_status} on {day} (was {att_status or 'not marked'})")
+            changes += 1
     return changes
 
-def get_attendance_record(employee_id, att_date):
-    att = frappe.get_all(
-        "Attendance",
-        filters={
-            "employee": employee_id,
-            "attendance_date": att_date,
-            "docstatus": 1
-        },
-        fields=["name", "status"]
-    )
-    if att:
-        return [att[0]["name"], att[0]["status"]]
+def get_attendance_map(employee_ids, month_start, until_date):
+    # One query for the whole window; keyed by (employee, "YYYY-MM-DD")
+    attendance_map = {}
+    if not employee_ids:
+        return attendance_map
+    rows = hr.get_attendance(employee_ids, month_start, until_date)
+    for row in rows:
+        key = (row.employee, str(row.attendance_date))
+        existing = attendance_map.get(key)
+        # Prefer the submitted record when a draft exists for the same day
+        if existing and existing["docstatus"] == 1:
+            continue
+        attendance_map[key] = {
+            "name": row.name,
+            "status": row.status,
+            "docstatus": row.docstatus,
+        }
+    return attendance_map
+
+def get_attendance_record(attendance_map, employee_id, att_date):
+    att = attendance_map.get((employee_id, str(att_date)))
+    if att and att["docstatus"] == 1:
+        return [att["name"], att["status"]]
     return [None, None]
 
-def change_attendance_status(employee_id, employee_name, attendance_date, shift_name, new_status, late_number, checkin_time):
-    print(f"Updating attendance on {attendance_date} to {new_status}")
-    att_rec = get_attendance_record(employee_id, attendance_date)
+def apply_attendance_corrections(corrections, attendance_map):
+    # Each correction (status, Version, comments) is committed on its own and
+    # rolled back on error, so a failed one leaves nothing half written.
+    # Server Scripts can't open a savepoint: frappe.db has no savepoint() and
+    # frappe.db.sql only runs SELECT
+    changed = 0
+    if corrections:
+        frappe.db.commit()
+    for corr in corrections:
+        try:
+            # Realtime mode: the ledger row commits with the correction, and a
+            # day the real-time action claimed since the load is left to it
+            if REALTIME_LATE_ENTRY_ENABLED and not hr.claim_notice(
+                corr["employee"], corr["attendance_date"], CORRECTION_NOTICE_TYPE
+            ):
+                continue
+            change_attendance_status(attendance_map, corr)
+            frappe.db.commit()
+            changed += 1
+        except Exception as e:
+            frappe.db.rollback()
+            telemetry.count(run, "errors")
+            frappe.log_error(
+                title=f"Attendance Change Error: {corr['employee']} ({corr['attendance_date']})",
+                message=str(e)
+            )
+            telemetry.debug(run, f"ERROR changing attendance for {corr['employee_name']} on {corr['attendance_date']} - {str(e)}")
+    if corrections:
+        frappe.db.commit()
+    return changed
+
+def change_attendance_status(attendance_map, corr):
+    employee_id = corr["employee"]
+    attendance_date = corr["attendance_date"]
+    new_status = corr["new_status"]
+    late_number = corr["late_number"]
+    telemetry.debug(run, f"Updating attendance on {attendance_date} to {new_status}")
+    att_rec = get_attendance_record(attendance_map, employee_id, attendance_date)
     att_name = att_rec[0]
     old_status = att_rec[1]
     if att_name:
-        att = frappe.get_doc("Attendance", att_name)
-        print(f"Found old attendance {att_name} status {old_status}")
-        if att.docstatus == 1:
-            att.flags.ignore_permissions = True
-            att.cancel()
-        att.delete()
-        print(f"Deleted old attendance {att_name}")
-    att = frappe.new_doc("Attendance")
-    att.employee = employee_id
-    att.employee_name = employee_name
-    att.attendance_date = attendance_date
-    att.company = frappe.db.get_value("Employee", employee_id, "company")
-    att.shift = shift_name
-    att.status = new_status
-    att.flags.ignore_permissions = True
-    att.save()
-    att.submit()
+        # Submitted record: change status in place instead of cancel + delete + recreate
+        frappe.db.set_value("Attendance", att_name, {"status": new_status, "shift": corr["shift"]})
+        hr.add_status_version(att_name, old_status, new_status)
+        telemetry.count(run, "writes", 2)
+        telemetry.debug(run, f"Updated attendance {att_name} status {old_status} -> {new_status}")
+    else:
+        att = frappe.new_doc("Attendance")
+        att.employee = employee_id
+        att.employee_name = corr["employee_name"]
+        att.attendance_date = attendance_date
+        att.company = corr["company"]
+        att.shift = corr["shift"]
+        att.status = new_status
+        att.flags.ignore_permissions = True
+        att.save()
+        att.submit()
+        att_name = att.name
+        telemetry.count(run, "writes", 2)
+    checkin_time = corr["checkin_time"]
     checkin_str = str(checkin_time)[11:16] if checkin_time else "-"
     comment_text = (
         f"Marked {new_status} automatically on {attendance_date} due to late entry number {late_number} of month. "
         f"First check-in: {checkin_str}."
     )
-    att.add_comment("Comment", comment_text)
-    frappe.get_doc("Employee", employee_id).add_comment("Comment", comment_text)
-    print(f"Attendance marked {new_status} and commented for {employee_name} on {attendance_date} (Late #{late_number})")
+    hr.add_comment("Attendance", att_name, comment_text)
+    hr.add_comment("Employee", employee_id, comment_text)
+    telemetry.count(run, "writes", 2)
+    attendance_map[(employee_id, str(attendance_date))] = {
+        "name": att_name,
+        "status": new_status,
+        "docstatus": 1,
+    }
+    telemetry.debug(run, f"Attendance marked {new_status} and commented for {corr['employee_name']} on {attendance_date} (Late #{late_number})")
 
-def get_employee_shift(employee_id, on_date):
+if coordinator.claim(telemetry, run):
     try:
-        shift_assignment = frappe.db.sql(
-            """
-            SELECT sa.shift_type AS shift
-            FROM `tabShift Assignment` sa
-            WHERE sa.employee = %s
-              AND sa.docstatus = 1
-              AND sa.start_date <= %s
-              AND (sa.end_date IS NULL OR sa.end_date >= %s)
-            ORDER BY sa.start_date DESC
-            LIMIT 1
-            """,
-            (employee_id, on_date, on_date),
-            as_dict=1,
-        )
-        shift_name = None
-        if shift_assignment:
-            shift_name = shift_assignment[0].get("shift")
-        if not shift_name:
-            shift_name = frappe.db.get_value("Employee", employee_id, "default_shift")
-        if not shift_name:
-            return None
-        return frappe.get_doc("Shift Type", shift_name)
+        execute()
     except Exception as e:
-        frappe.log_error(
-            title=f"Shift Lookup Exception: {employee_id}",
-            message=str(e)
-        )
-        print(f"ERROR finding shift for {employee_id} - {str(e)}")
-        return None
-
-def get_employee_checkins_for_month(employee_id, month_start, until_date):
-    try:
-        end_bound = frappe.utils.add_days(until_date, 1)
-        checkins = frappe.get_all(
-            "Employee Checkin",
-            filters={
-                "employee": employee_id,
-                "time": ["between", [month_start, end_bound]],
-                "log_type": "IN",
-            },
-            fields=["name", "time"],
-            order_by="time asc",
-        )
-        return checkins
-    except Exception as e:
-        frappe.log_error(
-            title=f"Checkin Fetch Exception: {employee_id}",
-            message=str(e)
-        )
-        print(f"ERROR fetching checkins for {employee_id} - {str(e)}")
-        return []
-
-def get_late_days_from_checkins(checkins, shift_start, late_grace_minutes):
-    per_day_first_in = {}
-    for ch in checkins:
-        ch_time = str(ch["time"])
-        ch_date = ch_time[:10]
-        if ch_date not in per_day_first_in:
-            per_day_first_in[ch_date] = []
-        per_day_first_in[ch_date].append(ch_time)
-    late_days = {}
-    for day in per_day_first_in:
-        times = per_day_first_in[day]
-        times.sort()
-        first_in = times[0]
-        print(f"Check-ins for {day}:")
-        for t in times:
-            print(f"   - {t}")
-        shift_hms = str(shift_start).split(":")
-        shift_hour = int(shift_hms[0])
-        shift_minute = int(shift_hms[1])
-        allowed_minute = shift_minute + late_grace_minutes
-        allowed_hour = shift_hour + allowed_minute // 60
-        allowed_minute = allowed_minute % 60
-        allowed_time = f"{allowed_hour:02d}:{allowed_minute:02d}"
-        first_in_time = first_in[11:16]
-        is_late = first_in_time > allowed_time
-        print(f"Day: {day}, First In: {first_in_time}, Allowed: {allowed_time}, Late: {is_late}")
-        late_days[day] = {
-            "is_late": is_late,
-            "first_in": first_in,
-        }
-    return late_days
-
-execute()
+        print(f"CRITICAL ERROR: {str(e)}")
+        frappe.log_error(message=str(e), title="Late Entry Cron - Critical Error")
+        telemetry.count(run, "errors")
+        telemetry.finish_run(run, "Failed")
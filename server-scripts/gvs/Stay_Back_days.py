@@ -1,7 +1,33 @@
+# Print (and keep on the HR Script Run record) every N-th debug line; 0 = off
+DEBUG_SAMPLE_EVERY = 0
+# Backfill: set both (YYYY-MM-DD) to evaluate every Monday-Sunday week in the
+# range in one run. Leave as None for the regular previous-week check.
+BACKFILL_FROM_DATE = None
+BACKFILL_TO_DATE = None
+# True: judge the 8.25h rule on hours from Employee Checkin (first IN to last OUT
+# of the day) instead of Attendance.working_hours, which is empty or stale when
+# attendance was auto-marked. Days without an IN/OUT pair keep working_hours.
+USE_CHECKIN_HOURS = False
+# One HR Notice Ledger row per corrected (employee, week), notice_date = the
+# Monday. Marking a day Absent drops it from the next run's week, so without
+# this a rerun or an overlapping backfill would mark another day of that week
+NOTICE_TYPE = "Stay Back Week"
+# Start of the comment left by mark_stayback_absent; finds weeks corrected
+# before the ledger row existed
+COMMENT_MARKER = "as this was not an attended stay back day"
+
+# (employee, week start) -> {"YYYY-MM-DD": hours}, filled one week at a time
+checkin_hours_cache = {}
+checkin_weeks_loaded = {}
+
+telemetry = run_script("HR Run Telemetry")
+run = telemetry.start_run("Stay_Back_days", DEBUG_SAMPLE_EVERY)
+hr = run_script("HR Data Access")
+hr.bind_run(telemetry, run)
+coordinator = run_script("HR Job Coordinator")
+
 def execute():
-    print("=" * 70)
-    print("STARTING STAYBACK ABSENT CHECK (Prioritize Present/Working, fallback to Half Day)")
-    print("=" * 70)
+    telemetry.start_phase(run, "load")
 
     today = frappe.utils.getdate('2025-12-08')
     weekday = today.weekday()
@@ -13,127 +39,222 @@ def execute():
     end_of_week = frappe.utils.add_days(today, -days_since_sunday)  # Last Sunday
     start_of_week = frappe.utils.add_days(end_of_week, -6)  # Previous Monday
 
-    print(f"Checking previous week: {str(start_of_week)} to {str(end_of_week)}")
+    if BACKFILL_FROM_DATE and BACKFILL_TO_DATE:
+        if frappe.utils.getdate(BACKFILL_FROM_DATE) > frappe.utils.getdate(BACKFILL_TO_DATE):
+            frappe.throw(
+                f"BACKFILL_FROM_DATE ({BACKFILL_FROM_DATE}) is after BACKFILL_TO_DATE ({BACKFILL_TO_DATE})",
+                title="Stay Back Days",
+            )
+        range_start = get_week_start(BACKFILL_FROM_DATE)
+        range_end = frappe.utils.add_days(get_week_start(BACKFILL_TO_DATE), 6)
+        # Never evaluate the week that is still running
+        if range_end > end_of_week:
+            range_end = end_of_week
+        print(f"Backfilling stayback weeks: {str(range_start)} to {str(range_end)}")
+    else:
+        range_start = start_of_week
+        range_end = end_of_week
+        print(f"Checking previous week: {str(start_of_week)} to {str(end_of_week)}")
+
+    employees = hr.get_employees({"status": "Active", "default_shift": "Vacation Staff Shift"})
+    telemetry.debug(run, f"Found {len(employees)} vacation staff employees")
+    if USE_CHECKIN_HOURS:
+        print("Working hours taken from Employee Checkin")
+
+    employee_ids = [emp.name for emp in employees]
+    corrected_weeks = get_corrected_weeks(employee_ids, range_start, range_end)
+    telemetry.debug(run, f"Weeks already corrected: {len(corrected_weeks)}")
+
+    telemetry.start_phase(run, "process")
+    corrections = get_stayback_corrections(employee_ids, range_start, range_end, corrected_weeks)
+    print(f"Stayback corrections to apply: {len(corrections)}")
+
+    telemetry.start_phase(run, "write")
+    apply_stayback_corrections(corrections, {emp.name: emp for emp in employees})
 
-    employees = frappe.get_all(
-        "Employee",
-        filters={"status": "Active", "default_shift": "Vacation Staff Shift"},
-        fields=["name", "employee_name", "default_shift", "company_email", "user_id"]
+    telemetry.finish_run(run)
+
+def get_week_start(day):
+    day = frappe.utils.getdate(day)
+    return frappe.utils.add_days(day, -day.weekday())
+
+def get_corrected_weeks(employee_ids, range_start, range_end):
+    # {(employee, "YYYY-MM-DD" Monday)} with a stayback correction: the ledger,
+    # plus the Employee comments of corrections made before it
+    corrected = hr.get_noticed_days(NOTICE_TYPE, range_start, range_end)
+    if not employee_ids:
+        return corrected
+    comments = telemetry.scan(run, frappe.get_all(
+        "Comment",
+        filters={
+            "reference_doctype": "Employee",
+            "reference_name": ["in", employee_ids],
+            "creation": [">=", str(range_start)],
+            "content": ["like", f"Marked Absent on % {COMMENT_MARKER}%"],
+        },
+        fields=["reference_name", "content"],
+    ))
+    for comment in comments:
+        # "Marked Absent on YYYY-MM-DD as this was ..."
+        absent_day = comment.content[len("Marked Absent on "):][:10]
+        corrected.add((comment.reference_name, str(get_week_start(absent_day))))
+    return corrected
+
+def get_stayback_corrections(employee_ids, range_start, range_end, corrected_weeks=()):
+    # One query for the whole range, ordered so each (employee, ISO week) bucket is
+    # contiguous; every bucket is evaluated as soon as the next one starts
+    corrections = []
+    if not employee_ids:
+        return corrections
+    rows = hr.get_attendance(
+        employee_ids, range_start, range_end,
+        filters={"docstatus": 1, "status": ["in", ["Present", "Working", "Half Day"]]},
     )
-    print(f"Found {len(employees)} vacation staff employees")
-
-    for emp in employees:
-        print("-" * 60)
-        print(f"Processing: {emp.get('employee_name')} ({emp.get('name')})")
-        
-        # 1. Check for any Present/Working days
-        pres_att = frappe.get_all(
-            "Attendance",
-            filters={
-                "employee": emp.name,
-                "attendance_date": ["between", [str(start_of_week), str(end_of_week)]],
-                "docstatus": 1,
-                "status": ["in", ["Present", "Working"]]
-            },
-            fields=["name", "attendance_date", "working_hours", "status"],
-            order_by="attendance_date asc"
-        )
-        
-        found_8_25 = False
-        below_pres = []
-        for att in pres_att:
-            wh = 0
-            try:
-                wh = float(att.get("working_hours") or 0)
-            except Exception:
-                pass
-            print(f"{att['attendance_date']}[{att['status']}]: {wh}")
-            if wh >= 8.25:
-                found_8_25 = True
-            else:
-                below_pres.append([str(att["attendance_date"]), att["name"], wh, att['status']])
-
-        # If there's a present/working stay back, do nothing
-        if found_8_25:
-            print("Attendance OK: at least one 'Present'/'Working' day >= 8.25 hours.")
-            continue
+    bucket_key = None
+    bucket = []
+    for row in rows:
+        key = (row.employee, get_week_start(row.attendance_date))
+        if key != bucket_key:
+            add_stayback_correction(corrections, bucket_key, bucket, employee_ids, corrected_weeks)
+            bucket_key = key
+            bucket = []
+        bucket.append(row)
+    add_stayback_correction(corrections, bucket_key, bucket, employee_ids, corrected_weeks)
+    return corrections
 
-        # If any Present/Working < 8.25, mark the first as absent
-        if below_pres:
-            first = sorted(below_pres, key=lambda t: t[0])[0]
-            mark_absent_and_notify(emp, first[0], first[1], first[2], first[3])
+def load_checkin_hours(employee_ids, week_start):
+    # One aggregation over the week's check-ins for every employee
+    week_key = str(week_start)
+    if week_key in checkin_weeks_loaded:
+        return
+    checkin_weeks_loaded[week_key] = True
+    rows = telemetry.scan(run, frappe.db.sql(
+        """
+        SELECT employee, DATE(`time`) AS day,
+            MIN(CASE WHEN log_type = 'IN' THEN `time` END) AS first_in,
+            MAX(CASE WHEN log_type = 'OUT' THEN `time` END) AS last_out
+        FROM `tabEmployee Checkin`
+        WHERE employee IN %s
+          AND `time` >= %s
+          AND `time` < %s
+        GROUP BY employee, DATE(`time`)
+        """,
+        (employee_ids, str(week_start), str(frappe.utils.add_days(week_start, 7))),
+        as_dict=1,
+    ))
+    for row in rows:
+        if not row.first_in or not row.last_out:
             continue
+        hours = frappe.utils.time_diff_in_hours(row.last_out, row.first_in)
+        if hours > 0:
+            checkin_hours_cache.setdefault((row.employee, week_key), {})[str(row.day)] = round(hours, 2)
 
-        # 2. Otherwise, try Half Day records
-        half_att = frappe.get_all(
-            "Attendance",
-            filters={
-                "employee": emp.name,
-                "attendance_date": ["between", [str(start_of_week), str(end_of_week)]],
-                "docstatus": 1,
-                "status": "Half Day"
-            },
-            fields=["name", "attendance_date", "working_hours", "status"],
-            order_by="attendance_date asc"
-        )
-        below_half = []
-        for att in half_att:
-            wh = 0
-            try:
-                wh = float(att.get("working_hours") or 0)
-            except Exception:
-                pass
-            print(f"{att['attendance_date']}[Half Day]: {wh}")
-            below_half.append([str(att["attendance_date"]), att["name"], wh, att['status']])
-        if below_half:
-            first = sorted(below_half, key=lambda t: t[0])[0]
-            mark_absent_and_notify(emp, first[0], first[1], first[2], first[3])
-        else:
-            print("Attendance OK: No Present/Working/Half Day in week or all are sufficient.")
-
-    print("=" * 70)
-    print("END OF STAYBACK ABSENT CHECK")
-    print("=" * 70)
-
-def mark_absent_and_notify(emp, absent_day, att_name, worked, old_status):
-    try:
-        if att_name:
-            att = frappe.get_doc("Attendance", att_name)
-            print(f"Found existing attendance record: {att_name} (status was {old_status})")
-            if att.docstatus == 1:
-                att.cancel()
-            att.delete()
-            print(f"Deleted old attendance record: {att_name}")
-        att = frappe.new_doc("Attendance")
-        att.employee = emp.name
-        att.employee_name = emp.employee_name
-        att.attendance_date = absent_day
-        att.company = frappe.db.get_value("Employee", emp.name, "company")
-        att.shift = emp.default_shift
-        att.status = "Absent"
-        att.flags.ignore_permissions = True
-        att.save()
-        att.submit()
-        comment_text = (
-            f"Marked Absent on {absent_day} as this was not an attended stay back day (no day >= 8h 15m, original status: {old_status}). "
-            f"Actual worked: {worked:.2f} hours."
-        )
-        att.add_comment("Comment", comment_text)
-        frappe.get_doc("Employee", emp.name).add_comment("Comment", comment_text)
-        print("Attendance marked Absent and comment added for", emp.employee_name)
-        send_stayback_absent_mail(emp, absent_day, worked)
-    except Exception as e:
-        frappe.log_error(
-            title=f"Stayback Absent Marking Error: {emp.name} ({absent_day})",
-            message=str(e)
-        )
-        print(f"ERROR marking absence for {emp.name} - {str(e)}")
+def apply_checkin_hours(employee_ids, bucket_key, week_rows):
+    load_checkin_hours(employee_ids, bucket_key[1])
+    week_hours = checkin_hours_cache.get((bucket_key[0], str(bucket_key[1])), {})
+    for att in week_rows:
+        hours = week_hours.get(str(att["attendance_date"]))
+        if hours is not None:
+            att["working_hours"] = hours
+
+def add_stayback_correction(corrections, bucket_key, week_rows, employee_ids, corrected_weeks=()):
+    if not week_rows:
+        return
+    telemetry.debug(run, f"Week of {str(bucket_key[1])}: {bucket_key[0]}")
+    if (bucket_key[0], str(bucket_key[1])) in corrected_weeks:
+        telemetry.debug(run, "SKIPPED: stayback correction already made for this week")
+        return
+    if USE_CHECKIN_HOURS:
+        apply_checkin_hours(employee_ids, bucket_key, week_rows)
+    first = get_first_short_stayback_day(week_rows)
+    if first:
+        corrections.append({
+            "employee": bucket_key[0],
+            "week_start": str(bucket_key[1]),
+            "attendance_date": first[0],
+            "attendance": first[1],
+            "worked": first[2],
+            "old_status": first[3],
+        })
 
-def send_stayback_absent_mail(emp, absent_day, worked):
+def apply_stayback_corrections(corrections, employees_by_id):
+    # Each correction (ledger row, status, Version, comments) is committed on its
+    # own and rolled back on error, as in Late_entry_Email_cron.py; emails are
+    # queued only for the ones that were written, after the commits
+    marked = []
+    if corrections:
+        frappe.db.commit()
+    for corr in corrections:
+        emp = employees_by_id[corr["employee"]]
+        try:
+            # Insert first: another run already corrected this week
+            if not hr.claim_notice(emp.name, corr["week_start"], NOTICE_TYPE):
+                continue
+            mark_stayback_absent(emp, corr)
+            frappe.db.commit()
+            marked.append(corr)
+        except Exception as e:
+            frappe.db.rollback()
+            telemetry.count(run, "errors")
+            frappe.log_error(
+                title=f"Stayback Absent Marking Error: {emp.name} ({corr['attendance_date']})",
+                message=str(e)
+            )
+            telemetry.debug(run, f"ERROR marking absence for {emp.name} - {str(e)}")
+    if not marked:
+        return
+    print(f"Attendance marked Absent: {len(marked)}")
+
+    sender_email = frappe.db.get_single_value("HR Settings", "sender_email")
+    if not sender_email:
+        sender_email = frappe.db.get_single_value("Email Account", "default_sender") or "no-reply@example.com"
+    for corr in marked:
+        send_stayback_absent_mail(employees_by_id[corr["employee"]], corr["attendance_date"], corr["worked"], sender_email)
+
+def get_first_short_stayback_day(week_rows):
+    # Single pass over one employee's week (date order). Returns
+    # [date, attendance, hours, status] of the day to mark Absent, or None when a
+    # Present/Working day reached 8.25 hours. A short Present/Working day wins
+    # over a Half Day; otherwise the first Half Day is used.
+    first_present = None
+    first_half = None
+    for att in week_rows:
+        wh = 0
+        try:
+            wh = float(att.get("working_hours") or 0)
+        except Exception:
+            pass
+        telemetry.debug(run, f"{att['attendance_date']}[{att['status']}]: {wh}")
+        if att["status"] == "Half Day":
+            if not first_half:
+                first_half = [str(att["attendance_date"]), att["name"], wh, att["status"]]
+        elif wh >= 8.25:
+            telemetry.debug(run, "Attendance OK: at least one 'Present'/'Working' day >= 8.25 hours.")
+            return None
+        elif not first_present:
+            first_present = [str(att["attendance_date"]), att["name"], wh, att["status"]]
+    if not first_present and not first_half:
+        telemetry.debug(run, "Attendance OK: No Present/Working/Half Day in week or all are sufficient.")
+    return first_present or first_half
+
+def mark_stayback_absent(emp, corr):
+    absent_day = corr["attendance_date"]
+    att_name = corr["attendance"]
+    old_status = corr["old_status"]
+    # Submitted record: change status in place instead of cancel + delete + recreate
+    frappe.db.set_value("Attendance", att_name, {"status": "Absent", "shift": emp.default_shift})
+    hr.add_status_version(att_name, old_status, "Absent")
+    comment_text = (
+        f"Marked Absent on {absent_day} as this was not an attended stay back day (no day >= 8h 15m, original status: {old_status}). "
+        f"Actual worked: {corr['worked']:.2f} hours."
+    )
+    hr.add_comment("Attendance", att_name, comment_text)
+    hr.add_comment("Employee", emp.name, comment_text)
+    telemetry.count(run, "writes", 5)
+    telemetry.debug(run, f"Attendance {att_name} marked Absent and comment added for {emp.employee_name}")
+
+def send_stayback_absent_mail(emp, absent_day, worked, sender_email):
     try:
-        sender_email = frappe.db.get_single_value("HR Settings", "sender_email")
-        if not sender_email:
-            sender_email = frappe.db.get_single_value("Email Account", "default_sender") or "no-reply@example.com"
         employee_email = emp.user_id or emp.company_email
         emp_first = emp.employee_name.split(" ")[0].capitalize() if emp.employee_name else "there"
         attendance_date_str = str(absent_day)
@@ -181,22 +302,29 @@ def send_stayback_absent_mail(emp, absent_day, worked):
   </div>
 </body>
         """
-        print("Sender Email:", sender_email)
-        print("Employee Email:", employee_email)
-        print("Email Body:\n", message)
         frappe.sendmail(
             sender=sender_email,
             recipients=[employee_email],
             subject=subject,
             message=message,
             header="Stayback Attendance Notice",
+            delayed=True,
         )
-        print("Email successfully sent to", employee_email)
+        telemetry.count(run, "emails")
+        telemetry.debug(run, f"Email queued for {employee_email}")
     except Exception as e:
+        telemetry.count(run, "errors")
         frappe.log_error(
             title=f"Stayback Absent Email Error: {emp.name} ({absent_day})",
             message=str(e)
         )
-        print(f"ERROR sending stayback absent email for {emp.name} - {str(e)}")
+        telemetry.debug(run, f"ERROR sending stayback absent email for {emp.name} - {str(e)}")
 
-execute()
+if coordinator.claim(telemetry, run):
+    try:
+        execute()
+    except Exception as e:
+        print(f"CRITICAL ERROR: {str(e)}")
+        frappe.log_error(message=str(e), title="Stay Back Days - Critical Error")
+        telemetry.count(run, "errors")
+        telemetry.finish_run(run, "Failed")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmarks for the scheduled HR Server Scripts.
+
+Every script in ``benchmarks.json`` is run at each configured employee count
+(100 / 1,000 / 10,000 by default). Wall time, reads, writes, rows fetched and
+peak Python memory are recorded for each run. For every pair of consecutive
+sizes the growth exponent of each metric is computed:
+
+    exponent = log(metric_large / metric_small) / log(employees_large / employees_small)
+
+0 means the metric is flat, 1 means linear in employees. The run fails when any
+exponent is above its bound. A script that starts querying once per employee
+again shows up as ``reads`` growing with an exponent near 1, against a bound
+of 0.1.
+
+Wall time is the median of ``repeats`` runs on a fresh copy of the data, so
+one slow run (GC pause, busy machine) does not fail the check. The other
+metrics are deterministic and taken from the first run.
+
+Examples:
+    python3 server-scripts/harness/benchmark.py
+    python3 server-scripts/harness/benchmark.py --sizes 100 1000 --only Stay_Back_days.py
+    python3 server-scripts/harness/benchmark.py --output /tmp/bench.json
+    python3 server-scripts/harness/benchmark.py --repeats 5
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(HARNESS_DIR, "..", ".."))
+sys.path.insert(0, HARNESS_DIR)
+
+from fake_frappe import FakeFrappe, run_script  # noqa: E402
+from synthetic_data import populate  # noqa: E402
+
+METRICS = ["seconds", "reads", "writes", "rows", "peak_memory"]
+
+
+def measure(base: FakeFrappe, path: str, today: datetime.date) -> dict:
+    frappe = base.clone(today=today)
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_script(frappe, path)
+    seconds = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    log = frappe.query_log
+    return {
+        "seconds": round(seconds, 4),
+        "reads": log.count - log.writes,
+        "writes": log.writes,
+        "rows": log.rows,
+        "peak_memory": peak_memory,
+        "errors": len(frappe.errors),
+    }
+
+
+def measure_repeated(base: FakeFrappe, path: str, today: datetime.date, repeats: int) -> dict:
+    """``measure`` ``repeats`` times; seconds is the median, the rest from the first run."""
+    runs = [measure(base, path, today) for _ in range(max(repeats, 1))]
+    result = dict(runs[0])
+    result["seconds"] = round(statistics.median(r["seconds"] for r in runs), 4)
+    return result
+
+
+def growth(small: float, large: float, size_ratio: float, floor: float = 0):
+    """Growth exponent between two sizes, or None when it is not meaningful."""
+    if large <= max(small, floor):
+        return 0.0
+    if small <= floor:
+        # Below the noise floor (or zero): measure from the floor instead
+        small = max(floor, 1)
+    return math.log(large / small) / math.log(size_ratio)
+
+
+def check(results: dict, sizes: list, bounds: dict, floors: dict) -> list:
+    failures = []
+    for small, large in zip(sizes, sizes[1:]):
+        for metric in METRICS:
+            exponent = growth(
+                results[small][metric], results[large][metric], large / small, floors.get(metric, 0)
+            )
+            results[large].setdefault("growth", {})[metric] = round(exponent, 3)
+            if exponent > bounds[metric]:
+                failures.append(
+                    f"{metric} grew {results[small][metric]} -> {results[large][metric]} "
+                    f"({small} -> {large} employees, exponent {exponent:.2f} > {bounds[metric]})"
+                )
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Scaling benchmarks for the HR Server Scripts")
+    parser.add_argument("--config", default=os.path.join(HARNESS_DIR, "benchmarks.json"))
+    parser.add_argument("--sizes", type=int, nargs="+", help="Override the employee counts")
+    parser.add_argument("--only", nargs="+", help="Run only scripts whose path ends with one of these")
+    parser.add_argument("--output", help="Write all measurements to this JSON file")
+    parser.add_argument("--repeats", type=int, help="Runs per script and size, median time kept (default from config)")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    sizes = sorted(args.sizes or config["sizes"])
+    window = [datetime.date.fromisoformat(d) for d in config["data_window"]]
+    default_today = datetime.date.fromisoformat(config["default_today"])
+    repeats = args.repeats or config.get("repeats", 1)
+    scripts = {
+        path: options for path, options in config["scripts"].items()
+        if not args.only or any(path.endswith(name) for name in args.only)
+    }
+
+    results = {path: {} for path in scripts}
+    for size in sizes:
+        seed_start = time.perf_counter()
+        base = FakeFrappe(today=default_today)
+        populate(base, employees=size, start=window[0], end=window[1])
+        print(f"Seeded {size} employees in {time.perf_counter() - seed_start:.1f}s")
+        for path, options in scripts.items():
+            today = datetime.date.fromisoformat(options.get("today", config["default_today"]))
+            results[path][size] = measure_repeated(base, os.path.join(REPO_ROOT, path), today, repeats)
+        del base
+
+    failed = False
+    print()
+    print(f"{'script':<34}{'employees':>10}{'seconds':>10}{'reads':>8}{'writes':>9}{'rows':>10}{'peak MiB':>10}")
+    for path, options in scripts.items():
+        bounds = dict(config["bounds"], **options.get("bounds", {}))
+        failures = check(results[path], sizes, bounds, config.get("floors", {}))
+        for size in sizes:
+            r = results[path][size]
+            print(
+                f"{os.path.basename(path):<34}{size:>10}{r['seconds']:>10.3f}{r['reads']:>8}"
+                f"{r['writes']:>9}{r['rows']:>10}{r['peak_memory'] / 1048576:>10.1f}"
+            )
+            if r["errors"]:
+                failures.append(f"{r['errors']} Error Log entries at {size} employees")
+        for failure in failures:
+            print(f"  FAIL {failure}")
+        failed = failed or bool(failures)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"sizes": sizes, "results": results}, f, indent=2)
+    print()
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,837 @@
+"""
+Offline stand-in for the ``frappe`` namespace seen by Server Scripts.
+
+Only the surface the GVS scripts use is provided: ``get_all``/``get_list``,
+``get_doc``/``new_doc``/``get_cached_doc``, ``db.sql`` (read only, like
+``safe_exec``), ``db.get_value``/``set_value``/``exists``/``count``,
+``sendmail``, ``enqueue``, ``render_template``, ``utils`` and the
+``run_script`` global for the shared API scripts. Tables live in
+an in-memory SQLite database named like the MariaDB ones (``tabEmployee``),
+so scripts keep their backtick-quoted SQL.
+
+Every statement is recorded in ``QueryLog`` so a run can report how many
+queries, of which shape, and how many rows came back.
+"""
+
+import calendar
+import datetime
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from typing import Dict, List
+
+STANDARD_COLUMNS = ["name", "owner", "creation", "modified", "docstatus", "parent", "idx"]
+
+# Single DocTypes are stored as one row keyed by doctype
+SINGLES_TABLE = "tabSingles"
+
+# ``format:`` autoname rules of the custom DocTypes the scripts rely on
+AUTONAME_RULES = {
+    "HR Notice Ledger": "{employee}-{notice_date}-{notice_type}",
+}
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gvs")
+
+# API Server Scripts other scripts load with ``run_script(<name>)``
+SERVER_SCRIPTS = {
+    "HR Run Telemetry": os.path.join(SCRIPTS_DIR, "HR_Run_Telemetry.py"),
+    "HR Data Access": os.path.join(SCRIPTS_DIR, "HR_Data_Access.py"),
+    "HR Job Coordinator": os.path.join(SCRIPTS_DIR, "HR_Job_Coordinator.py"),
+}
+
+# Stands in for the site database name returned by MariaDB's DATABASE()
+SITE_DATABASE = "_harness_site"
+
+
+class _dict(dict):
+    """Attribute access dict, same as ``frappe._dict``."""
+
+    def __getattr__(self, key):
+        return self.get(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class QueryLog:
+    """Counts statements, their normalised shape and rows returned."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.writes = 0
+        self.rows = 0
+        self.shapes = Counter()
+        # Writes per table, e.g. to tell a script's own writes from telemetry
+        self.written_tables = Counter()
+
+    def record(self, sql: str, rows: int, write: bool = False):
+        self.count += 1
+        self.rows += rows
+        if write:
+            self.writes += 1
+            table = re.search(r"(?:INSERT INTO|UPDATE|DELETE FROM)\s+`([^`]+)`", sql)
+            self.written_tables[table.group(1) if table else "?"] += 1
+        shape = re.sub(r"\s+", " ", sql).strip()
+        shape = re.sub(r"'[^']*'", "?", shape)
+        shape = re.sub(r"\b\d+(\.\d+)?\b", "?", shape)
+        shape = re.sub(r"\((\?, )+\?\)", "(?...)", shape)
+        self.shapes[shape[:160]] += 1
+
+    def summary(self) -> Dict:
+        return {
+            "queries": self.count,
+            "writes": self.writes,
+            "rows": self.rows,
+            "shapes": len(self.shapes),
+        }
+
+
+class Flags(_dict):
+    pass
+
+
+class FrappeException(Exception):
+    pass
+
+
+def _scrub(doctype: str) -> str:
+    return f"tab{doctype}"
+
+
+def _to_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _to_datetime(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(str(value))
+
+
+def _db_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class Utils:
+    """Subset of ``frappe.utils`` used by the scripts."""
+
+    def __init__(self, today: datetime.date = None):
+        self.today_date = today or datetime.date.today()
+
+    def getdate(self, value=None):
+        if value is None:
+            return self.today_date
+        return _to_date(value)
+
+    def get_datetime(self, value=None):
+        if value is None:
+            return datetime.datetime.combine(self.today_date, datetime.time())
+        return _to_datetime(value)
+
+    def nowdate(self):
+        return str(self.today_date)
+
+    def today(self):
+        return str(self.today_date)
+
+    def now(self):
+        return str(datetime.datetime.combine(self.today_date, datetime.datetime.now().time()))
+
+    def now_datetime(self):
+        return datetime.datetime.combine(self.today_date, datetime.datetime.now().time())
+
+    def add_days(self, value, days):
+        value = _to_datetime(value) if " " in str(value) else _to_date(value)
+        return value + datetime.timedelta(days=days)
+
+    def add_to_date(self, value, days=0, hours=0, minutes=0, seconds=0, as_string=False):
+        value = _to_datetime(value) + datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+        return str(value) if as_string else value
+
+    def add_months(self, value, months):
+        value = _to_date(value)
+        month = value.month - 1 + months
+        year = value.year + month // 12
+        month = month % 12 + 1
+        day = min(value.day, calendar.monthrange(year, month)[1])
+        return datetime.date(year, month, day)
+
+    def get_first_day(self, value):
+        return _to_date(value).replace(day=1)
+
+    def get_last_day(self, value):
+        value = _to_date(value)
+        return value.replace(day=calendar.monthrange(value.year, value.month)[1])
+
+    def date_diff(self, a, b):
+        return (_to_date(a) - _to_date(b)).days
+
+    def time_diff_in_hours(self, a, b):
+        return (_to_datetime(a) - _to_datetime(b)).total_seconds() / 3600
+
+    def time_diff_in_seconds(self, a, b):
+        return (_to_datetime(a) - _to_datetime(b)).total_seconds()
+
+    def formatdate(self, value, fmt=None):
+        value = _to_date(value)
+        if fmt == "dd-MM-yyyy":
+            return value.strftime("%d-%m-%Y")
+        return str(value)
+
+    def flt(self, value, precision=None):
+        value = float(value or 0)
+        return round(value, precision) if precision is not None else value
+
+    def cint(self, value):
+        try:
+            return int(value or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def cstr(self, value):
+        return "" if value is None else str(value)
+
+
+class Document(_dict):
+    """Minimal Document: insert/save/submit/cancel/delete + comments."""
+
+    def __init__(self, frappe, data: Dict):
+        super().__init__(data)
+        object.__setattr__(self, "_frappe", frappe)
+        self["flags"] = Flags()
+        self.setdefault("docstatus", 0)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def _row(self):
+        return {k: v for k, v in self.items() if k not in ("flags", "doctype")}
+
+    def insert(self, ignore_permissions=False, ignore_mandatory=False, **kwargs):
+        self._frappe._insert(self)
+        return self
+
+    def save(self, ignore_permissions=False, **kwargs):
+        if self.get("name") and self._frappe.db.exists(self.doctype, self.name):
+            self._frappe._update(self)
+        else:
+            self._frappe._insert(self)
+        return self
+
+    def submit(self):
+        self.docstatus = 1
+        return self.save()
+
+    def cancel(self):
+        self.docstatus = 2
+        return self.save()
+
+    def delete(self, ignore_permissions=False):
+        self._frappe._delete(self.doctype, self.name)
+
+    def reload(self):
+        fresh = self._frappe.get_doc(self.doctype, self.name)
+        for key, value in fresh.items():
+            if key != "flags":
+                self[key] = value
+        return self
+
+    def db_set(self, fieldname, value=None, update_modified=True):
+        values = fieldname if isinstance(fieldname, dict) else {fieldname: value}
+        self.update(values)
+        self._frappe.db.set_value(self.doctype, self.name, values)
+
+    def add_comment(self, comment_type="Comment", text=None, **kwargs):
+        return self._frappe.get_doc({
+            "doctype": "Comment",
+            "comment_type": comment_type,
+            "reference_doctype": self.doctype,
+            "reference_name": self.name,
+            "content": text,
+        }).insert(ignore_permissions=True)
+
+
+class Database:
+    """``frappe.db`` over SQLite, recording every statement."""
+
+    def __init__(self, frappe):
+        self.frappe = frappe
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        self.columns: Dict[str, List[str]] = {}
+        self.commits = 0
+        self.rollbacks = 0
+        # Named locks (GET_LOCK) held by this session, and ones another session
+        # holds; add to ``other_session_locks`` to simulate an overlapping run
+        self.locks = Counter()
+        self.other_session_locks = set()
+        self._register_functions()
+
+    def _register_functions(self):
+        """MariaDB functions the coordinator calls, and an empty process list."""
+        self.conn.create_function("GET_LOCK", 2, self._get_lock)
+        self.conn.create_function("RELEASE_LOCK", 1, self._release_lock)
+        self.conn.create_function("CONCAT", -1, lambda *parts: "".join(str(p) for p in parts))
+        self.conn.create_function("DATABASE", 0, lambda: SITE_DATABASE)
+        self.conn.create_function("CONNECTION_ID", 0, lambda: 1)
+        self.conn.create_function("SLEEP", 1, lambda seconds: 0)
+        self.conn.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        self.conn.execute(
+            "CREATE TABLE information_schema.PROCESSLIST (ID, USER, DB, COMMAND, TIME, STATE, INFO)"
+        )
+
+    def _get_lock(self, name, timeout):
+        if name in self.other_session_locks:
+            return 0
+        self.locks[name] += 1
+        return 1
+
+    def _release_lock(self, name):
+        if not self.locks[name]:
+            return None
+        self.locks[name] -= 1
+        return 1
+
+    # ---------- schema ----------
+
+    def ensure_table(self, doctype: str, fields: List[str] = ()):
+        table = _scrub(doctype)
+        if table not in self.columns:
+            cols = list(dict.fromkeys(STANDARD_COLUMNS + list(fields)))
+            col_sql = ", ".join(f"`{c}`" for c in cols)
+            self.conn.execute(f"CREATE TABLE `{table}` ({col_sql})")
+            self.conn.execute(f"CREATE INDEX `{table}_name` ON `{table}` (`name`)")
+            self.columns[table] = cols
+            return
+        for field in fields:
+            if field not in self.columns[table]:
+                self.conn.execute(f"ALTER TABLE `{table}` ADD COLUMN `{field}`")
+                self.columns[table].append(field)
+
+    def add_index(self, doctype: str, fields: List[str], index_name: str = None):
+        table = _scrub(doctype)
+        self.ensure_table(doctype, fields)
+        index_name = index_name or "_".join(fields)
+        cols = ", ".join(f"`{f}`" for f in fields)
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS `{table}_{index_name}` ON `{table}` ({cols})")
+
+    def add_unique(self, doctype: str, fields: List[str], constraint_name: str = None):
+        table = _scrub(doctype)
+        self.ensure_table(doctype, fields)
+        constraint_name = constraint_name or "unique_" + "_".join(fields)
+        cols = ", ".join(f"`{f}`" for f in fields)
+        self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS `{table}_{constraint_name}` ON `{table}` ({cols})")
+
+    def bulk_load(self, doctype: str, rows: List[Dict]):
+        """Seed rows without recording them as script queries."""
+        if not rows:
+            self.ensure_table(doctype)
+            return
+        fields = list(dict.fromkeys(k for row in rows for k in row))
+        self.ensure_table(doctype, fields)
+        table = _scrub(doctype)
+        cols = ", ".join(f"`{f}`" for f in fields)
+        marks = ", ".join("?" for _ in fields)
+        self.conn.executemany(
+            f"INSERT INTO `{table}` ({cols}) VALUES ({marks})",
+            [[_db_value(row.get(f, 0 if f == "docstatus" else None)) for f in fields] for row in rows],
+        )
+
+    # ---------- execution ----------
+
+    def _execute(self, sql: str, params=(), write=False):
+        params = [_db_value(p) for p in params]
+        cursor = self.conn.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else []
+        self.frappe.query_log.record(sql, len(rows), write=write)
+        return cursor, rows
+
+    def sql(self, query: str, values=(), as_dict=False, pluck=False, as_list=False):
+        query = str(query)
+        if not query.strip().lower().startswith(("select", "with", "explain")):
+            raise FrappeException("Query must be of SELECT or read-only WITH type.")
+        if isinstance(values, dict):
+            sql = re.sub(r"%\((\w+)\)s", r":\1", query)
+            params = {k: _db_value(v) for k, v in values.items()}
+            cursor = self.conn.execute(self._translate(sql), params)
+            rows = cursor.fetchall()
+            self.frappe.query_log.record(query, len(rows))
+        else:
+            sql, params = self._expand_params(query, values)
+            cursor, rows = self._execute(self._translate(sql), params)
+        return self._shape(cursor, rows, as_dict, pluck)
+
+    def _expand_params(self, query, values):
+        values = list(values or ())
+        params = []
+        parts = query.split("%s")
+        sql = parts[0]
+        for i, part in enumerate(parts[1:]):
+            value = values[i]
+            if isinstance(value, (list, tuple)):
+                sql += "(" + ", ".join("?" for _ in value) + ")" + part
+                params.extend(value)
+            else:
+                sql += "?" + part
+                params.append(value)
+        return sql, params
+
+    def _translate(self, sql: str) -> str:
+        # MariaDB spellings used by the scripts that SQLite does not share
+        sql = re.sub(r"TIMESTAMPDIFF\(\s*SECOND\s*,\s*([^,]+?)\s*,\s*([^)]+?)\s*\)",
+                     r"(strftime('%s', \2) - strftime('%s', \1))", sql, flags=re.I)
+        sql = re.sub(r"\bCURDATE\(\)", "date('now')", sql, flags=re.I)
+        sql = re.sub(r"DATE_FORMAT\(\s*([^,]+?)\s*,\s*'%Y-%m'\s*\)", r"strftime('%Y-%m', \1)", sql, flags=re.I)
+        sql = re.sub(r"YEARWEEK\(\s*([^,]+?)\s*,\s*3\s*\)", r"strftime('%Y%W', \1)", sql, flags=re.I)
+        sql = re.sub(r"\bTIME_TO_SEC\(\s*TIME\(([^)]+)\)\s*\)",
+                     r"(CAST(strftime('%s', \1) AS INTEGER) % 86400)", sql, flags=re.I)
+        sql = re.sub(r"\bTIME_TO_SEC\(([^)]+)\)",
+                     r"(CAST(strftime('%s', '1970-01-01 ' || \1) AS INTEGER))", sql, flags=re.I)
+        sql = re.sub(r"\bDIV\b", "/", sql, flags=re.I)
+        return sql
+
+    def _shape(self, cursor, rows, as_dict=False, pluck=False):
+        if not cursor.description:
+            return []
+        cols = [c[0] for c in cursor.description]
+        if pluck:
+            return [r[0] for r in rows]
+        if as_dict:
+            return [_dict(zip(cols, r)) for r in rows]
+        return [tuple(r) for r in rows]
+
+    # ---------- filters ----------
+
+    def build_where(self, doctype: str, filters, or_filters=None):
+        table = _scrub(doctype)
+        clauses, params = [], []
+        for field, op, value in self._normalise_filters(filters):
+            self.ensure_table(doctype, [field])
+            clause, clause_params = self._condition(table, field, op, value)
+            clauses.append(clause)
+            params.extend(clause_params)
+        if or_filters:
+            ors = []
+            for field, op, value in self._normalise_filters(or_filters):
+                self.ensure_table(doctype, [field])
+                clause, clause_params = self._condition(table, field, op, value)
+                ors.append(clause)
+                params.extend(clause_params)
+            clauses.append("(" + " OR ".join(ors) + ")")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _normalise_filters(self, filters):
+        if not filters:
+            return []
+        if isinstance(filters, str):
+            return [("name", "=", filters)]
+        out = []
+        if isinstance(filters, dict):
+            for field, value in filters.items():
+                if isinstance(value, (list, tuple)) and value and isinstance(value[0], str) and len(value) == 2:
+                    out.append((field, value[0].lower(), value[1]))
+                else:
+                    out.append((field, "=", value))
+            return out
+        for f in filters:
+            if len(f) == 4:
+                f = f[1:]
+            out.append((f[0], f[1].lower(), f[2]))
+        return out
+
+    def _condition(self, table, field, op, value):
+        col = f"`{table}`.`{field}`"
+        if op in ("=", "!=", "<", "<=", ">", ">=", "like", "not like"):
+            sql_op = {"!=": "IS NOT"}.get(op, op) if value is None else op
+            if op == "!=" and value is not None:
+                return f"({col} != ? OR {col} IS NULL)", [value]
+            return f"{col} {sql_op} ?", [value]
+        if op in ("in", "not in"):
+            values = list(value) if not isinstance(value, str) else [v.strip() for v in value.split(",")]
+            if not values:
+                return ("1=0" if op == "in" else "1=1"), []
+            marks = ", ".join("?" for _ in values)
+            return f"{col} {op.upper()} ({marks})", values
+        if op == "between":
+            start, end = value
+            if end is not None and len(str(end)) == 10:
+                end = str(end) + " 23:59:59.999999"
+            return f"{col} BETWEEN ? AND ?", [start, end]
+        if op == "is":
+            return (f"({col} IS NOT NULL AND {col} != '')" if value == "set"
+                    else f"({col} IS NULL OR {col} = '')"), []
+        raise FrappeException(f"Unsupported filter operator {op}")
+
+    # ---------- frappe.db API ----------
+
+    def get_all(self, doctype, filters=None, fields=None, order_by=None, limit=None,
+                limit_page_length=None, pluck=None, distinct=False, or_filters=None,
+                group_by=None, **kwargs):
+        table = _scrub(doctype)
+        self.ensure_table(doctype)
+        if pluck:
+            fields = [pluck]
+        fields = fields or ["name"]
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(",")]
+        select = []
+        for f in fields:
+            if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", f):
+                self.ensure_table(doctype, [f])
+                select.append(f"`{table}`.`{f}`")
+            else:
+                select.append(f)
+        where, params = self.build_where(doctype, filters, or_filters)
+        sql = f"SELECT {'DISTINCT ' if distinct else ''}{', '.join(select)} FROM `{table}`{where}"
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        limit = limit or limit_page_length
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        cursor, rows = self._execute(sql, params)
+        return self._shape(cursor, rows, as_dict=not pluck, pluck=bool(pluck))
+
+    def get_value(self, doctype, filters=None, fieldname="name", as_dict=False, order_by=None, **kwargs):
+        if filters is None:
+            filters = doctype
+        single = isinstance(fieldname, str) and fieldname != "*"
+        fields = [fieldname] if single else (fieldname if fieldname != "*" else None)
+        if fields is None:
+            self.ensure_table(doctype)
+            fields = list(self.columns[_scrub(doctype)])
+        rows = self.get_all(doctype, filters=filters, fields=fields, order_by=order_by, limit=1)
+        if not rows:
+            return None
+        if as_dict:
+            return rows[0]
+        if single:
+            return rows[0][fieldname]
+        return tuple(rows[0][f] for f in fields)
+
+    def get_single_value(self, doctype, fieldname):
+        self.ensure_table("Singles", ["doctype", "field", "value"])
+        cursor, rows = self._execute(
+            f"SELECT `value` FROM `{SINGLES_TABLE}` WHERE `doctype` = ? AND `field` = ?",
+            [doctype, fieldname],
+        )
+        return rows[0][0] if rows else None
+
+    def set_single_value(self, doctype, fieldname, value):
+        self.ensure_table("Singles", ["doctype", "field", "value"])
+        self.conn.execute(f"DELETE FROM `{SINGLES_TABLE}` WHERE `doctype` = ? AND `field` = ?", [doctype, fieldname])
+        self.conn.execute(
+            f"INSERT INTO `{SINGLES_TABLE}` (`doctype`, `field`, `value`) VALUES (?, ?, ?)",
+            [doctype, fieldname, _db_value(value)],
+        )
+
+    def set_value(self, doctype, name, fieldname, value=None, update_modified=True):
+        values = dict(fieldname) if isinstance(fieldname, dict) else {fieldname: value}
+        if update_modified:
+            values["modified"] = self.frappe.utils.now()
+        self.ensure_table(doctype, list(values))
+        table = _scrub(doctype)
+        sets = ", ".join(f"`{k}` = ?" for k in values)
+        if isinstance(name, dict):
+            where, params = self.build_where(doctype, name)
+        else:
+            where, params = " WHERE `name` = ?", [name]
+        self._execute(f"UPDATE `{table}` SET {sets}{where}", list(values.values()) + params, write=True)
+
+    def exists(self, doctype, filters=None, **kwargs):
+        if isinstance(doctype, dict):
+            filters = dict(doctype)
+            doctype = filters.pop("doctype")
+        if filters is None:
+            return None
+        return self.get_value(doctype, filters, "name")
+
+    def count(self, doctype, filters=None, **kwargs):
+        rows = self.get_all(doctype, filters=filters, fields=["count(*) as cnt"])
+        return rows[0]["cnt"] if rows else 0
+
+    def escape(self, value, percent=True):
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def commit(self):
+        self.conn.commit()
+        self.commits += 1
+
+    def rollback(self):
+        self.conn.rollback()
+        self.rollbacks += 1
+
+
+class FakeFrappe:
+    """The ``frappe`` object handed to Server Scripts."""
+
+    def __init__(self, today: datetime.date = None, user: str = "Administrator"):
+        self.query_log = QueryLog()
+        self.utils = Utils(today)
+        self.db = Database(self)
+        self.flags = Flags()
+        self.session = _dict(user=user)
+        self.form_dict = _dict()
+        self.sent_mail: List[Dict] = []
+        self.enqueued: List[Dict] = []
+        self.errors: List[Dict] = []
+        self._name_counters = Counter()
+
+    def clone(self, today: datetime.date = None) -> "FakeFrappe":
+        """Fresh ``frappe`` over a copy of this database (seed once, run many)."""
+        other = FakeFrappe(today=today or self.utils.today_date, user=self.session.user)
+        self.db.conn.backup(other.db.conn)
+        other.db.columns = {table: list(cols) for table, cols in self.db.columns.items()}
+        other._name_counters = Counter(self._name_counters)
+        return other
+
+    # ---------- documents ----------
+
+    def _autoname(self, doc):
+        if doc.get("name"):
+            return doc.name
+        rule = AUTONAME_RULES.get(doc.doctype)
+        if rule:
+            self.db.add_unique(doc.doctype, ["name"], "primary")
+            return rule.format(**doc)
+        self._name_counters[doc.doctype] += 1
+        prefix = "".join(w[0] for w in doc.doctype.split()).upper()
+        return f"{prefix}-{self._name_counters[doc.doctype]:07d}"
+
+    def _insert(self, doc: Document):
+        doc.name = self._autoname(doc)
+        now = self.utils.now()
+        doc.setdefault("owner", self.session.user)
+        doc.setdefault("creation", now)
+        doc["modified"] = now
+        row = doc._row()
+        self.db.ensure_table(doc.doctype, list(row))
+        table = _scrub(doc.doctype)
+        cols = ", ".join(f"`{k}`" for k in row)
+        marks = ", ".join("?" for _ in row)
+        try:
+            self.db._execute(f"INSERT INTO `{table}` ({cols}) VALUES ({marks})", list(row.values()), write=True)
+        except sqlite3.IntegrityError as e:
+            raise FrappeException(f"Duplicate entry for {doc.doctype}: {e}")
+
+    def _update(self, doc: Document):
+        values = {k: v for k, v in doc._row().items() if k != "name"}
+        self.db.set_value(doc.doctype, doc.name, values)
+
+    def _delete(self, doctype, name):
+        self.db._execute(f"DELETE FROM `{_scrub(doctype)}` WHERE `name` = ?", [name], write=True)
+
+    def get_doc(self, doctype, name=None, **kwargs):
+        if isinstance(doctype, dict):
+            return Document(self, dict(doctype))
+        rows = self.db.get_all(doctype, filters={"name": name}, fields=["*"], limit=1)
+        if not rows:
+            raise FrappeException(f"{doctype} {name} not found")
+        data = dict(rows[0])
+        data["doctype"] = doctype
+        return Document(self, data)
+
+    def delete_doc(self, doctype, name, ignore_permissions=False, **kwargs):
+        self._delete(doctype, name)
+
+    def get_cached_doc(self, doctype, name=None):
+        return self.get_doc(doctype, name)
+
+    def new_doc(self, doctype):
+        return Document(self, {"doctype": doctype})
+
+    def get_all(self, doctype, *args, **kwargs):
+        return self.db.get_all(doctype, *args, **kwargs)
+
+    get_list = get_all
+
+    # ---------- side effects ----------
+
+    def sendmail(self, recipients=None, sender=None, subject=None, message=None, **kwargs):
+        self.sent_mail.append(_dict(recipients=recipients, sender=sender, subject=subject,
+                                    message=message, **kwargs))
+        self.query_log.record("INSERT INTO `tabEmail Queue`", 0, write=True)
+
+    def enqueue(self, method, **kwargs):
+        self.enqueued.append(_dict(method=method, **kwargs))
+
+    def log_error(self, title=None, message=None, **kwargs):
+        self.errors.append(_dict(title=title, message=message))
+
+    def throw(self, msg, *args, **kwargs):
+        raise FrappeException(msg)
+
+    def msgprint(self, msg, *args, **kwargs):
+        pass
+
+    def render_template(self, template: str, context: Dict) -> str:
+        return render_template(template, context)
+
+    def as_json(self, obj, indent=1):
+        return json.dumps(obj, indent=indent, default=str)
+
+    def _(self, msg):
+        return msg
+
+
+_TAG = re.compile(r"{%\s*(.*?)\s*%}|{{\s*(.*?)\s*}}", re.S)
+
+
+def render_template(template: str, context: Dict) -> str:
+    """Small Jinja subset: ``{{ var }}``, ``{% if var %}`` (with ``==``) and
+    ``{% for a, b in items %}``. Enough for the templates the scripts ship;
+    anything else should be checked on a bench."""
+    tokens, pos = [], 0
+    for match in _TAG.finditer(template):
+        tokens.append(("text", template[pos:match.start()]))
+        if match.group(1) is not None:
+            tokens.append(("tag", match.group(1)))
+        else:
+            tokens.append(("var", match.group(2)))
+        pos = match.end()
+    tokens.append(("text", template[pos:]))
+    body, _ = _parse(tokens, 0, ())
+    out: List[str] = []
+    _render(body, dict(context), out)
+    return "".join(out)
+
+
+def _parse(tokens, i, stop):
+    nodes = []
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if kind == "tag":
+            word = value.split()[0]
+            if word in stop:
+                return nodes, i
+            if word == "for":
+                inner, i = _parse(tokens, i + 1, ("endfor",))
+                nodes.append(("for", value, inner))
+            elif word == "if":
+                inner, i = _parse(tokens, i + 1, ("endif", "else"))
+                other = []
+                if tokens[i][1].split()[0] == "else":
+                    other, i = _parse(tokens, i + 1, ("endif",))
+                nodes.append(("if", value, inner, other))
+            i += 1
+            continue
+        nodes.append((kind, value))
+        i += 1
+    return nodes, i
+
+
+def _resolve(expr, context):
+    expr = expr.strip()
+    if re.fullmatch(r"-?\d+", expr):
+        return int(expr)
+    if expr[:1] in "'\"":
+        return expr[1:-1]
+    value = context
+    for part in expr.split("."):
+        value = value.get(part) if isinstance(value, dict) else getattr(value, part, None)
+    return value
+
+
+def _render(nodes, context, out):
+    for node in nodes:
+        if node[0] == "text":
+            out.append(node[1])
+        elif node[0] == "var":
+            value = _resolve(node[1], context)
+            out.append("" if value is None else str(value))
+        elif node[0] == "if":
+            cond = node[1][2:].strip()
+            if "==" in cond:
+                left, right = cond.split("==", 1)
+                truth = _resolve(left, context) == _resolve(right, context)
+            else:
+                truth = bool(_resolve(cond, context))
+            _render(node[2] if truth else node[3], context, out)
+        elif node[0] == "for":
+            match = re.fullmatch(r"for\s+(.+?)\s+in\s+(.+)", node[1].strip(), re.S)
+            names = [n.strip() for n in match.group(1).split(",")]
+            for item in _resolve(match.group(2), context) or []:
+                scope = dict(context)
+                if len(names) == 1:
+                    scope[names[0]] = item
+                else:
+                    scope.update(zip(names, item))
+                _render(node[2], scope, out)
+
+
+def script_globals(frappe: FakeFrappe, **extra) -> Dict:
+    """Globals a Server Script sees under ``safe_exec``."""
+    out = {
+        "frappe": frappe,
+        "json": json,
+        "_dict": _dict,
+        "_": frappe._,
+        "as_json": frappe.as_json,
+        "run_script": lambda name: _run_api_script(frappe, name),
+    }
+    out.update(extra)
+    return out
+
+
+def _run_api_script(frappe: FakeFrappe, name: str):
+    """``run_script(name)``: execute an API Server Script, return its ``frappe.flags``.
+
+    ``safe_exec`` gives every script its own ``frappe.flags``, so the caller's
+    flags are swapped out for the duration of the call.
+    """
+    with open(SERVER_SCRIPTS[name]) as f:
+        code = compile(f.read(), SERVER_SCRIPTS[name], "exec")
+    caller_flags, frappe.flags = frappe.flags, Flags()
+    try:
+        exec(code, script_globals(frappe))
+        return frappe.flags
+    finally:
+        frappe.flags = caller_flags
+
+
+def run_script(frappe: FakeFrappe, path: str, doc: Document = None,
+               constants: Dict[str, str] = None, **extra) -> Dict:
+    """Execute a Server Script file the way ``safe_exec`` would and time it.
+
+    DocType Event scripts get ``doc`` in a separate locals mapping, exactly like
+    ``safe_exec(script, _locals={"doc": doc})``, so they fail here the same way
+    they would on a bench if top-level helpers try to call each other.
+
+    ``constants`` replaces top-level settings (``{"USE_CHECKIN_HOURS": "True"}``),
+    as an admin would edit them in the Server Script form.
+    """
+    with open(path) as f:
+        source = f.read()
+    for name, value in (constants or {}).items():
+        source, found = re.subn(rf"^{name} = .*$", f"{name} = {value}", source, count=1, flags=re.M)
+        if not found:
+            raise KeyError(f"{path} has no top-level {name}")
+    code = compile(source, path, "exec")
+    exec_globals = script_globals(frappe, **extra)
+    start = time.perf_counter()
+    if doc is not None:
+        exec(code, exec_globals, {"doc": doc})
+    else:
+        exec(code, exec_globals)
+    return {"seconds": time.perf_counter() - start}
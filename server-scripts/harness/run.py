@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Run a GVS Server Script offline against synthetic data and report its queries.
+
+Examples:
+    python3 server-scripts/harness/run.py server-scripts/gvs/Late_entry_Email_cron.py
+    python3 server-scripts/harness/run.py server-scripts/gvs/Stay_Back_days.py -e 1000 --today 2025-12-08
+    python3 server-scripts/harness/run.py ANNUAL_LEAVE_SCRIPT/annual_leaves.py --shapes 10 --show-output
+    python3 server-scripts/harness/run.py server-scripts/gvs/Stay_Back_days.py -e 1000 --rerun \
+        --set USE_CHECKIN_HOURS=True --set BACKFILL_FROM_DATE='"2025-11-03"' --set BACKFILL_TO_DATE='"2025-12-07"'
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_frappe import FakeFrappe, run_script  # noqa: E402
+from synthetic_data import DEFAULT_END, DEFAULT_START, populate  # noqa: E402
+
+
+# Written by every run (HR Run Telemetry), so not counted against --rerun
+TELEMETRY_TABLES = {"tabHR Script Run"}
+
+
+def _date(value: str) -> datetime.date:
+    return datetime.date.fromisoformat(value)
+
+
+def _constant(value: str) -> tuple:
+    name, sep, literal = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {value!r}")
+    return name.strip(), literal.strip()
+
+
+def run(path: str, employees: int, today: datetime.date, start: datetime.date,
+        end: datetime.date, seed: int, constants: dict = None, rerun: bool = False) -> dict:
+    """Seed a fresh database, execute the script once and collect the counters.
+
+    With ``rerun`` the script runs a second time on the same database; a job that
+    is safe to repeat writes nothing and sends nothing on that run.
+    """
+    frappe = FakeFrappe(today=today)
+    populate(frappe, employees=employees, start=start, end=end, seed=seed)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        timing = run_script(frappe, path, constants=constants)
+    summary = frappe.query_log.summary()
+    top_shapes = frappe.query_log.shapes.most_common()
+    counts = {"commits": frappe.db.commits, "emails": len(frappe.sent_mail),
+              "enqueued": len(frappe.enqueued), "errors": len(frappe.errors)}
+    rerun_result = None
+    if rerun:
+        frappe.query_log.reset()
+        with contextlib.redirect_stdout(output):
+            run_script(frappe, path, constants=constants)
+        rerun_result = {
+            "writes": {table: count for table, count in frappe.query_log.written_tables.items()
+                       if table not in TELEMETRY_TABLES},
+            "emails": len(frappe.sent_mail) - counts["emails"],
+            "errors": len(frappe.errors) - counts["errors"],
+        }
+    return {
+        "script": os.path.basename(path),
+        "employees": employees,
+        "seconds": round(timing["seconds"], 4),
+        "queries": summary["queries"],
+        "writes": summary["writes"],
+        "rows": summary["rows"],
+        "query_shapes": summary["shapes"],
+        **counts,
+        "top_shapes": top_shapes,
+        "output": output.getvalue(),
+        "error_log": frappe.errors,
+        "rerun": rerun_result,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a Server Script against the offline harness")
+    parser.add_argument("script", help="Path to the Server Script file")
+    parser.add_argument("-e", "--employees", type=int, default=100, help="Synthetic employees (default 100)")
+    parser.add_argument("--today", type=_date, default=datetime.date(2025, 11, 28),
+                        help="Date returned by frappe.utils.getdate()/today() (default 2025-11-28)")
+    parser.add_argument("--start", type=_date, default=DEFAULT_START, help="First day of synthetic check-ins/attendance")
+    parser.add_argument("--end", type=_date, default=DEFAULT_END, help="Last day of synthetic check-ins/attendance")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed for the data generator")
+    parser.add_argument("--shapes", type=int, default=5, help="Print the N most frequent query shapes")
+    parser.add_argument("--show-output", action="store_true", help="Print the script's own stdout")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    parser.add_argument("--set", type=_constant, action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a top-level setting of the script (Python literal), repeatable")
+    parser.add_argument("--rerun", action="store_true",
+                        help="Run a second time on the same data and fail if that run writes or sends anything")
+    args = parser.parse_args()
+
+    result = run(args.script, args.employees, args.today, args.start, args.end, args.seed,
+                 dict(args.set), args.rerun)
+    rerun = result["rerun"]
+    failed = bool(result["errors"]) or bool(rerun and (rerun["writes"] or rerun["emails"] or rerun["errors"]))
+
+    if args.json:
+        result["top_shapes"] = result["top_shapes"][:args.shapes]
+        if not args.show_output:
+            result.pop("output")
+        print(json.dumps(result, indent=2, default=str))
+        return 1 if failed else 0
+
+    if args.show_output:
+        print(result["output"])
+    print(f"Script     : {result['script']} ({result['employees']} employees)")
+    print(f"Run time   : {result['seconds']}s")
+    print(f"Queries    : {result['queries']} ({result['writes']} writes, {result['query_shapes']} distinct shapes)")
+    print(f"Rows read  : {result['rows']}")
+    print(f"Commits    : {result['commits']}")
+    print(f"Emails     : {result['emails']} | Enqueued jobs: {result['enqueued']} | Error Logs: {result['errors']}")
+    if args.shapes:
+        print("Top query shapes:")
+        for shape, count in result["top_shapes"][:args.shapes]:
+            print(f"  {count:>7}  {shape}")
+    if rerun:
+        writes = ", ".join(f"{table}: {count}" for table, count in sorted(rerun["writes"].items())) or "none"
+        print(f"Second run : writes {writes} | Emails: {rerun['emails']} | Error Logs: {rerun['errors']}")
+    for error in result["error_log"][:5]:
+        print(f"Error Log  : {error.get('title')} - {error.get('message')}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
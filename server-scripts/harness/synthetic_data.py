@@ -0,0 +1,153 @@
+"""
+Synthetic HR data for the offline harness.
+
+``populate(frappe, employees=N)`` seeds a FakeFrappe database with the
+records the GVS scripts read: employees, shifts, check-ins, attendance,
+leave periods/types/policies/allocations/applications and holidays. The
+generator is seeded, so the same size always yields the same data and
+query counts are comparable between runs.
+"""
+
+import datetime
+import random
+
+from fake_frappe import FakeFrappe
+
+COMPANY = "PossibleWorks"
+GENERAL_SHIFT = "General Shift"
+VACATION_SHIFT = "Vacation Staff Shift"
+LEAVE_POLICY = "HR-LPOL-2025-00006-1"
+HOLIDAY_LIST = "GVS Holidays 2025"
+
+# Window covering the hard-coded run dates of the late-entry and stayback jobs
+DEFAULT_START = datetime.date(2025, 11, 1)
+DEFAULT_END = datetime.date(2025, 12, 31)
+
+
+def _working_days(start, end):
+    day = start
+    while day <= end:
+        if day.weekday() != 6:
+            yield day
+        day += datetime.timedelta(days=1)
+
+
+def populate(
+    frappe: FakeFrappe,
+    employees: int = 100,
+    start: datetime.date = DEFAULT_START,
+    end: datetime.date = DEFAULT_END,
+    late_ratio: float = 0.2,
+    vacation_ratio: float = 0.2,
+    seed: int = 7,
+) -> None:
+    rnd = random.Random(seed)
+    db = frappe.db
+
+    db.set_single_value("HR Settings", "sender_email", "hr@example.com")
+    db.bulk_load("Shift Type", [
+        {"name": GENERAL_SHIFT, "start_time": "09:30:00", "end_time": "18:30:00", "late_entry_grace_period": 10},
+        {"name": VACATION_SHIFT, "start_time": "09:00:00", "end_time": "17:00:00", "late_entry_grace_period": 10},
+    ])
+    db.bulk_load("Leave Period", [
+        {"name": "HR-LPR-2025-00001", "from_date": "2025-04-01", "to_date": "2026-03-31", "is_active": 1},
+    ])
+    db.bulk_load("Leave Type", [
+        {"name": "Annual Leaves", "max_leaves_allowed": 15},
+        {"name": "Casual Leave", "max_leaves_allowed": 10},
+    ])
+    db.bulk_load("Holiday List", [{"name": HOLIDAY_LIST}])
+    db.bulk_load("Holiday", [
+        {"name": f"HOL-{i}", "parent": HOLIDAY_LIST, "parenttype": "Holiday List", "holiday_date": d}
+        for i, d in enumerate(["2025-10-02", "2025-10-20", "2025-11-05", "2025-12-25", "2026-01-01", "2026-01-26"])
+    ])
+
+    employee_rows, assignments, policy_rows = [], [], []
+    checkins, attendance, allocations, applications = [], [], [], []
+    days = list(_working_days(start, end))
+
+    for i in range(1, employees + 1):
+        emp_id = f"HR-EMP-{i:05d}"
+        vacation = rnd.random() < vacation_ratio
+        shift = VACATION_SHIFT if vacation else GENERAL_SHIFT
+        shift_start = datetime.time(9, 0) if vacation else datetime.time(9, 30)
+        probation_end = datetime.date(2025, 1, 1) + datetime.timedelta(days=rnd.randint(0, 300))
+        employee_rows.append({
+            "name": emp_id,
+            "employee_name": f"Employee {i}",
+            "user_id": f"employee{i}@example.com" if i % 17 else None,
+            "company_email": f"employee{i}@corp.example.com",
+            "company": COMPANY,
+            "status": "Active" if i % 25 else "Left",
+            "default_shift": shift,
+            "holiday_list": HOLIDAY_LIST,
+            "custom_probation_end_date": str(probation_end),
+            "date_of_joining": str(probation_end - datetime.timedelta(days=180)),
+        })
+        if i % 3 == 0:
+            assignments.append({
+                "name": f"HR-SHA-{i:05d}", "employee": emp_id, "shift_type": shift,
+                "start_date": "2025-04-01", "end_date": None, "docstatus": 1,
+            })
+        policy_rows.append({
+            "name": f"HR-LPA-{i:05d}", "employee": emp_id, "employee_name": f"Employee {i}",
+            "leave_policy": LEAVE_POLICY, "docstatus": 1,
+        })
+        if i % 2 == 0:
+            allocations.append({
+                "name": f"HR-LAL-AL-{i:05d}", "employee": emp_id, "leave_type": "Annual Leaves",
+                "from_date": "2025-04-01", "to_date": "2026-03-31", "docstatus": 1,
+                "new_leaves_allocated": 10.0, "total_leaves_allocated": 10.0,
+            })
+            applications.append({
+                "name": f"HR-LAP-{i:05d}", "employee": emp_id, "leave_type": "Annual Leaves",
+                "from_date": "2025-06-10", "to_date": "2025-06-11", "total_leave_days": 2,
+                "status": "Approved", "docstatus": 1,
+            })
+        if i % 4 == 0:
+            allocations.append({
+                "name": f"HR-LAL-CL-{i:05d}", "employee": emp_id, "leave_type": "Casual Leave",
+                "from_date": "2025-05-01", "to_date": "2025-05-31", "docstatus": 1,
+                "new_leaves_allocated": 1.0, "total_leaves_allocated": 1.0,
+            })
+
+        for n, day in enumerate(days):
+            late = rnd.random() < late_ratio
+            minutes = rnd.randint(11, 90) if late else rnd.randint(-20, 9)
+            first_in = datetime.datetime.combine(day, shift_start) + datetime.timedelta(minutes=minutes)
+            worked = rnd.uniform(7.0, 9.5)
+            out = first_in + datetime.timedelta(hours=worked)
+            checkins.append({
+                "name": f"CHK-{i:05d}-{n:03d}-1", "employee": emp_id, "log_type": "IN",
+                "time": str(first_in), "shift": shift,
+            })
+            if rnd.random() < 0.3:
+                # Repeat IN after a break; only the first one of the day counts
+                checkins.append({
+                    "name": f"CHK-{i:05d}-{n:03d}-2", "employee": emp_id, "log_type": "IN",
+                    "time": str(first_in + datetime.timedelta(hours=4)), "shift": shift,
+                })
+            checkins.append({
+                "name": f"CHK-{i:05d}-{n:03d}-3", "employee": emp_id, "log_type": "OUT",
+                "time": str(out), "shift": shift,
+            })
+            status = "Half Day" if worked < 7.2 else "Present"
+            attendance.append({
+                "name": f"HR-ATT-{i:05d}-{n:03d}", "employee": emp_id, "employee_name": f"Employee {i}",
+                "attendance_date": str(day), "status": status, "docstatus": 1, "shift": shift,
+                "company": COMPANY, "working_hours": round(worked, 2),
+            })
+
+    db.bulk_load("Employee", employee_rows)
+    db.bulk_load("Shift Assignment", assignments)
+    db.bulk_load("Leave Policy Assignment", policy_rows)
+    db.bulk_load("Leave Allocation", allocations)
+    db.bulk_load("Leave Application", applications)
+    db.bulk_load("Employee Checkin", checkins)
+    db.bulk_load("Attendance", attendance)
+    db.add_index("Employee Checkin", ["employee", "time"])
+    db.add_index("Attendance", ["employee", "attendance_date"])
+    db.add_index("Shift Assignment", ["employee"])
+    db.add_index("Leave Allocation", ["employee", "leave_type"])
+    db.commit()
+    frappe.query_log.reset()